@@ -9,6 +9,7 @@ pygtk.require('2.0')
 import gtk
 from parse import *
 import model
+import testcache
 
 # File informations
 __author__="Deepank Gupta"
@@ -113,7 +114,7 @@ class EducationalToolkitActivity(activity.Activity):
         self.notebook.show()
         # Let's append a bunch of pages to the notebook
         
-        test = parse_test("data/sample.xml")
+        test = testcache.parse_test("data/sample.xml")
         i = 1
         for question in test.questions:
             bufferf = "%s    %d credits    %s Difficulty" % (question.id, question.credits, question.difficulty)
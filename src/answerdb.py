@@ -6,25 +6,55 @@
 
 """
 Instructor database for student results.
+
+<p>Which questions a student got right, got wrong or still needs grading on
+are stored one row per question in the <code>result_questions</code> table,
+so per-question queries can use its indexes.  Databases made before this
+table existed kept the questions as CSV in the <code>results</code> table;
+run {@link migrate migrate} (or <code>answerdb.py migrate URL</code>) to move
+them over.</p>
+
+<p>Each test's result count, sums of the counts and histogram of scores
+(correct counts) are kept in the <code>test_summaries</code> and
+<code>score_counts</code> tables, updated in the same transaction as the
+results.  <code>answerdb.py rebuild-summaries URL</code> recomputes them.</p>
 """
 
-from cStringIO import StringIO
 import csv
+import sys
+import time
 
-from sqlalchemy import (Table, Column, MetaData, create_engine,
-                        Integer, String, Unicode, ForeignKey)
-from sqlalchemy.orm import mapper, relation, sessionmaker, synonym
+from sqlalchemy import (Table, Column, MetaData, Index, create_engine,
+                        Integer, String, Unicode, ForeignKey, select, func,
+                        and_)
+from sqlalchemy.orm import (mapper, relation, sessionmaker, synonym,
+                            MapperExtension, EXT_CONTINUE)
+from sqlalchemy.orm.session import SessionExtension
 
 import model
 
 __author__ = "Ross Light"
 __date__ = "April 2, 2008"
 __docformat__ = "JavaDoc"
-__all__ = ['create_session',
+__all__ = ['CORRECT',
+           'INCORRECT',
+           'PENDING',
+           'create_session',
            'TestRecord',
-           'PersistentResults',]
+           'PersistentResults',
+           'QuestionResult',
+           'get_question_summary',
+           'find_students',
+           'get_test_summary',
+           'ingest_results',
+           'rebuild_summaries',
+           'migrate',]
 
-create_session = sessionmaker(autoflush=True, transactional=True)
+# Question statuses
+CORRECT = 1
+INCORRECT = 2
+PENDING = 3
+_STATUSES = (CORRECT, INCORRECT, PENDING)
 
 ### TABLES ###
 
@@ -37,13 +67,33 @@ results_table = Table('results', metadata,
     Column('result_id', Integer, primary_key=True),
     Column('test_id', Integer, ForeignKey('tests.test_oid')),
     Column('student_name', Unicode(255)),
-    Column('correct_list', String(2047)),
     Column('correct_count', Integer),
-    Column('incorrect_list', String(2047)),
     Column('incorrect_count', Integer),
-    Column('pending_list', String(2047)),
     Column('pending_count', Integer),
 )
+result_questions_table = Table('result_questions', metadata,
+    Column('result_id', Integer, ForeignKey('results.result_id'),
+           primary_key=True),
+    Column('status', Integer, primary_key=True),
+    Column('position', Integer, primary_key=True),
+    Column('question_id', String(255), nullable=False),
+)
+Index('ix_result_questions_question', result_questions_table.c.question_id,
+      result_questions_table.c.status)
+test_summaries_table = Table('test_summaries', metadata,
+    Column('test_id', Integer, ForeignKey('tests.test_oid'),
+           primary_key=True),
+    Column('result_count', Integer, nullable=False),
+    Column('correct_sum', Integer, nullable=False),
+    Column('incorrect_sum', Integer, nullable=False),
+    Column('pending_sum', Integer, nullable=False),
+)
+score_counts_table = Table('score_counts', metadata,
+    Column('test_id', Integer, ForeignKey('tests.test_oid'),
+           primary_key=True),
+    Column('score', Integer, primary_key=True),
+    Column('result_count', Integer, nullable=False),
+)
 
 ### CLASSES ###
 
@@ -65,6 +115,11 @@ class PersistentResults(model.Results):
     """
     Results from a set of {@link Answer Answers}.
     
+    <p>The question lists are decoded from their rows once and then cached.
+    Setting a list only updates the cache and the count; the rows are
+    written when the session flushes, so the session must come from
+    {@link create_session create_session}.</p>
+    
     @ivar test The test these results are for
     @type test {@link TestRecord TestRecord}
     @ivar student_name The student's name
@@ -87,61 +142,690 @@ class PersistentResults(model.Results):
             list_data.append(value)
         return tuple(list_data)
     
-    @staticmethod
-    def _encode_list_data(list_data):
-        if list_data is None:
-            return None
-        fake_file = StringIO()
-        writer = csv.writer(fake_file)
-        for value in list_data:
-            writer.writerow([value])
-        del writer
-        return fake_file.getvalue()
+    def _get_questions(self, status):
+        cache = self.__dict__.setdefault('_questions', {})
+        try:
+            return cache[status]
+        except KeyError:
+            pass
+        # Decode every list in one pass over the rows
+        question_ids = dict((each_status, []) for each_status in _STATUSES)
+        for entry in self._entries:
+            question_ids[entry.status].append(entry.question_id)
+        for each_status in _STATUSES:
+            cache.setdefault(each_status, tuple(question_ids[each_status]))
+        return cache[status]
+    
+    def _set_questions(self, status, question_ids):
+        question_ids = tuple(question_ids) if question_ids is not None else ()
+        self.__dict__.setdefault('_questions', {})[status] = question_ids
+        self.__dict__.setdefault('_unsaved', set()).add(status)
+        return len(question_ids)
+    
+    def _save_questions(self):
+        """Writes changed lists out to the rows.  Called at flush time."""
+        unsaved = self.__dict__.get('_unsaved')
+        if not unsaved:
+            return
+        cache = self._questions
+        for status in unsaved:
+            question_ids = cache[status]
+            old_entries = [entry for entry in self._entries
+                           if entry.status == status]
+            # Reuse the existing rows, so that changing a list updates rows
+            # instead of deleting and re-inserting the same keys
+            for entry, qid in zip(old_entries, question_ids):
+                if entry.question_id != qid:
+                    entry.question_id = qid
+            for entry in old_entries[len(question_ids):]:
+                self._entries.remove(entry)
+            for position in xrange(len(old_entries), len(question_ids)):
+                self._entries.append(QuestionResult(question_ids[position],
+                                                    status, position))
+        unsaved.clear()
+    
+    def _forget_questions(self):
+        """Drops the decoded lists, after the rows have been (re)loaded."""
+        self.__dict__.pop('_questions', None)
+        self.__dict__.pop('_unsaved', None)
     
     def _get_correct(self):
-        return self._parse_list_data(self._correct_list)
+        return self._get_questions(CORRECT)
     def _set_correct(self, value):
-        self._correct_list = self._encode_list_data(value)
-        self._correct_count = len(value) if value is not None else 0
+        self._correct_count = self._set_questions(CORRECT, value)
     correct = property(_get_correct, _set_correct)
     @property
     def correct_count(self):
         return self._correct_count
     
     def _get_incorrect(self):
-        return self._parse_list_data(self._incorrect_list)
+        return self._get_questions(INCORRECT)
     def _set_incorrect(self, value):
-        self._incorrect_list = self._encode_list_data(value)
-        self._incorrect_count = len(value) if value is not None else 0
+        self._incorrect_count = self._set_questions(INCORRECT, value)
     incorrect = property(_get_incorrect, _set_incorrect)
     @property
     def incorrect_count(self):
         return self._incorrect_count
     
     def _get_pending(self):
-        return self._parse_list_data(self._pending_list)
+        return self._get_questions(PENDING)
     def _set_pending(self, value):
-        self._pending_list = self._encode_list_data(value)
-        self._pending_count = len(value) if value is not None else 0
+        self._pending_count = self._set_questions(PENDING, value)
     pending = property(_get_pending, _set_pending)
     @property
     def pending_count(self):
         return self._pending_count
+    
+    def to_bitset(self, index=None):
+        """
+        Converts the results to bitset form, for fast grading.
+        
+        @keyword index The question index to use (usually shared by all the
+                       results for a test)
+        @type index {@link model.QuestionIndex QuestionIndex}
+        @returntype {@link model.BitsetResults BitsetResults}
+        """
+        return model.BitsetResults.from_results(self, index)
+    
+    def update(self, results):
+        """
+        Stores the grading from other results, such as
+        {@link model.BitsetResults BitsetResults} graded in memory.
+        
+        @param results The results to copy
+        @type results {@link model.Results Results}
+        """
+        self.correct = results.correct
+        self.incorrect = results.incorrect
+        self.pending = results.pending
+
+class QuestionResult(object):
+    """
+    The grading of one question in a set of
+    {@link PersistentResults results}.
+    
+    @ivar result The results this belongs to
+    @type result {@link PersistentResults PersistentResults}
+    @ivar question_id The question's ID
+    @type question_id str
+    @ivar status {@link CORRECT CORRECT}, {@link INCORRECT INCORRECT} or
+                 {@link PENDING PENDING}
+    @type status int
+    @ivar position The question's position in its status's list
+    @type position int
+    """
+    def __init__(self, question_id, status, position):
+        self.question_id = question_id
+        self.status = status
+        self.position = position
+
+class _ResultsMapperExtension(MapperExtension):
+    def populate_instance(self, mapper, selectcontext, row, instance,
+                          **flags):
+        if flags.get('isnew'):
+            instance._forget_questions()
+        return EXT_CONTINUE
+    
+    # Keep the test summaries up to date, in the flush's transaction
+    
+    def after_insert(self, mapper, connection, instance):
+        changes = {}
+        _add_summary_change(changes, _get_summary_row(instance), 1)
+        _apply_summary_changes(connection, changes)
+        return EXT_CONTINUE
+    
+    def before_update(self, mapper, connection, instance):
+        old_row = _load_summary_row(connection, instance.result_id)
+        new_row = _get_summary_row(instance)
+        if old_row != new_row:
+            changes = {}
+            _add_summary_change(changes, old_row, -1)
+            _add_summary_change(changes, new_row, 1)
+            _apply_summary_changes(connection, changes)
+        return EXT_CONTINUE
+    
+    def before_delete(self, mapper, connection, instance):
+        changes = {}
+        _add_summary_change(changes,
+                            _load_summary_row(connection, instance.result_id),
+                            -1)
+        _apply_summary_changes(connection, changes)
+        return EXT_CONTINUE
+
+class _ResultsSessionExtension(SessionExtension):
+    def before_flush(self, session, flush_context, instances):
+        for instance in list(session.new) + list(session.dirty):
+            if isinstance(instance, PersistentResults):
+                instance._save_questions()
+
+create_session = sessionmaker(autoflush=True, transactional=True,
+                              extension=_ResultsSessionExtension())
+
+### QUERIES ###
+
+def get_question_summary(session, test=None):
+    """
+    Counts how each question was graded, using the question index.
+    
+    @param session The session to query with
+    @keyword test Only count results for this test
+    @type test {@link TestRecord TestRecord}
+    @return The number of correct, incorrect and pending answers to each
+            question, keyed by question ID
+    @returntype dict
+    """
+    questions = result_questions_table
+    query = select([questions.c.question_id, questions.c.status,
+                    func.count(questions.c.result_id)],
+                   group_by=[questions.c.question_id, questions.c.status])
+    if test is not None:
+        query = query.where(and_(
+            questions.c.result_id == results_table.c.result_id,
+            results_table.c.test_id == test.test_oid))
+    summary = {}
+    columns = {CORRECT: 0, INCORRECT: 1, PENDING: 2}
+    for question_id, status, count in session.execute(query):
+        counts = summary.setdefault(question_id, [0, 0, 0])
+        counts[columns[status]] = count
+    return dict((question_id, tuple(counts))
+                for question_id, counts in summary.iteritems())
+
+def find_students(session, question_id, status=INCORRECT, test=None):
+    """
+    Finds the results with a question graded a certain way.
+    
+    @param session The session to query with
+    @param question_id The question's ID
+    @type question_id str
+    @keyword status The grading to look for
+    @type status int
+    @keyword test Only look at results for this test
+    @type test {@link TestRecord TestRecord}
+    @returntype list of {@link PersistentResults PersistentResults}
+    """
+    questions = result_questions_table
+    result_ids = select([questions.c.result_id],
+                        and_(questions.c.question_id == question_id,
+                             questions.c.status == status))
+    query = session.query(PersistentResults).filter(
+        results_table.c.result_id.in_(result_ids))
+    if test is not None:
+        query = query.filter(results_table.c.test_id == test.test_oid)
+    return query.all()
+
+### SUMMARIES ###
+
+def _get_summary_row(results):
+    """
+    Gets what the summaries need to know about a set of results.
+    
+    @return (test OID, correct count, incorrect count, pending count)
+    @returntype tuple
+    """
+    test_id = results.test_id
+    if test_id is None and results.test is not None:
+        test_id = results.test.test_oid
+    return (test_id, results.correct_count or 0,
+            results.incorrect_count or 0, results.pending_count or 0)
+
+def _load_summary_row(connection, result_id):
+    """Gets the stored version of {@link _get_summary_row _get_summary_row}."""
+    row = connection.execute(select([results_table.c.test_id,
+                                     results_table.c.correct_count,
+                                     results_table.c.incorrect_count,
+                                     results_table.c.pending_count],
+                                    results_table.c.result_id == result_id)
+                             ).fetchone()
+    if row is None:
+        return (None, 0, 0, 0)
+    return (row[0], row[1] or 0, row[2] or 0, row[3] or 0)
+
+def _add_summary_change(changes, row, sign):
+    """
+    Adds (or, with a <code>sign</code> of <code>-1</code>, removes) a set of
+    results to the pending summary changes.
+    
+    @param changes [result count, correct sum, incorrect sum, pending sum,
+                   {score: result count}] lists, keyed by test OID
+    @type changes dict
+    """
+    test_id, correct, incorrect, pending = row
+    if test_id is None:
+        return
+    try:
+        change = changes[test_id]
+    except KeyError:
+        change = changes[test_id] = [0, 0, 0, 0, {}]
+    change[0] += sign
+    change[1] += sign * correct
+    change[2] += sign * incorrect
+    change[3] += sign * pending
+    change[4][correct] = change[4].get(correct, 0) + sign
+
+def _apply_summary_changes(connection, changes):
+    """Writes the changes gathered by {@link _add_summary_change
+    _add_summary_change}."""
+    summaries = test_summaries_table
+    scores = score_counts_table
+    for test_id, change in changes.iteritems():
+        result_count, correct, incorrect, pending, histogram = change
+        updated = connection.execute(summaries.update(
+            summaries.c.test_id == test_id,
+            values={summaries.c.result_count:
+                        summaries.c.result_count + result_count,
+                    summaries.c.correct_sum: summaries.c.correct_sum + correct,
+                    summaries.c.incorrect_sum:
+                        summaries.c.incorrect_sum + incorrect,
+                    summaries.c.pending_sum:
+                        summaries.c.pending_sum + pending,})).rowcount
+        if not updated:
+            connection.execute(summaries.insert(), test_id=test_id,
+                               result_count=result_count,
+                               correct_sum=correct, incorrect_sum=incorrect,
+                               pending_sum=pending)
+        for score, count in histogram.iteritems():
+            if count == 0:
+                continue
+            score_clause = and_(scores.c.test_id == test_id,
+                                scores.c.score == score)
+            updated = connection.execute(scores.update(
+                score_clause,
+                values={scores.c.result_count:
+                            scores.c.result_count + count})).rowcount
+            if not updated:
+                connection.execute(scores.insert(), test_id=test_id,
+                                   score=score, result_count=count)
+            elif count < 0:
+                connection.execute(scores.delete(and_(
+                    score_clause, scores.c.result_count <= 0)))
+
+def get_test_summary(session, test):
+    """
+    Retrieves the class-level summary of a test's results.
+    
+    This reads the maintained summary tables, so it costs the same however
+    many results the test has.
+    
+    @param session The session to query with
+    @param test The test to summarize
+    @type test {@link TestRecord TestRecord}
+    @return A dictionary with <code>result_count</code>,
+            <code>correct_sum</code>, <code>incorrect_sum</code>,
+            <code>pending_sum</code>, <code>average_correct</code> (or
+            <code>None</code> with no results) and <code>histogram</code>
+            (the number of results with each correct count)
+    @returntype dict
+    """
+    summaries = test_summaries_table
+    scores = score_counts_table
+    row = session.execute(select([summaries.c.result_count,
+                                  summaries.c.correct_sum,
+                                  summaries.c.incorrect_sum,
+                                  summaries.c.pending_sum],
+                                 summaries.c.test_id == test.test_oid)
+                          ).fetchone()
+    if row is None:
+        row = (0, 0, 0, 0)
+    summary = dict(zip(('result_count', 'correct_sum', 'incorrect_sum',
+                        'pending_sum'), row))
+    if summary['result_count']:
+        summary['average_correct'] = (summary['correct_sum'] /
+                                      float(summary['result_count']))
+    else:
+        summary['average_correct'] = None
+    summary['histogram'] = dict(session.execute(
+        select([scores.c.score, scores.c.result_count],
+               scores.c.test_id == test.test_oid)).fetchall())
+    return summary
+
+def rebuild_summaries(bind):
+    """
+    Recomputes every test summary from the results table.
+    
+    Use this to repair the summaries if results were changed without going
+    through the ORM or {@link ingest_results ingest_results}.
+    
+    @param bind The engine or connection of the database
+    @return The number of tests summarized
+    @returntype int
+    """
+    results = results_table
+    connection = bind.connect()
+    transaction = connection.begin()
+    try:
+        connection.execute(score_counts_table.delete())
+        connection.execute(test_summaries_table.delete())
+        summary_rows = [dict(test_id=row[0], result_count=row[1],
+                             correct_sum=row[2] or 0,
+                             incorrect_sum=row[3] or 0,
+                             pending_sum=row[4] or 0)
+                        for row in connection.execute(select(
+                            [results.c.test_id,
+                             func.count(results.c.result_id),
+                             func.sum(results.c.correct_count),
+                             func.sum(results.c.incorrect_count),
+                             func.sum(results.c.pending_count)],
+                            results.c.test_id != None,
+                            group_by=[results.c.test_id]))]
+        score = func.coalesce(results.c.correct_count, 0)
+        score_rows = [dict(test_id=row[0], score=row[1],
+                           result_count=row[2])
+                      for row in connection.execute(select(
+                          [results.c.test_id, score,
+                           func.count(results.c.result_id)],
+                          results.c.test_id != None,
+                          group_by=[results.c.test_id, score]))]
+        if summary_rows:
+            connection.execute(test_summaries_table.insert(), summary_rows)
+        if score_rows:
+            connection.execute(score_counts_table.insert(), score_rows)
+        transaction.commit()
+    except:
+        transaction.rollback()
+        raise
+    finally:
+        connection.close()
+    return len(summary_rows)
+
+### BULK INGESTION ###
+
+def _get_or_create_tests(connection, real_ids, chunk_size=500):
+    """
+    Finds the <code>test_oid</code> of each test, creating missing tests.
+    
+    The tests are looked up with a query per <code>chunk_size</code> IDs;
+    any missing tests are then created with one batched insert and looked
+    up again.
+    
+    @return The OIDs, keyed by real ID, and the number of tests created
+    @returntype tuple of (dict, int)
+    """
+    real_ids = list(real_ids)
+    def find(ids):
+        oids = {}
+        # Keep the IN lists short enough for every database
+        for i in xrange(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+            query = select([tests_table.c.test_real_id,
+                            tests_table.c.test_oid],
+                           tests_table.c.test_real_id.in_(chunk))
+            oids.update(connection.execute(query).fetchall())
+        return oids
+    oids = find(real_ids)
+    missing = [real_id for real_id in real_ids if real_id not in oids]
+    if missing:
+        connection.execute(tests_table.insert(),
+                           [dict(test_real_id=real_id)
+                            for real_id in missing])
+        oids.update(find(missing))
+    return oids, len(missing)
+
+def ingest_results(bind, items, batch_size=1000):
+    """
+    Stores many results at once.
+    
+    <p>This bypasses the ORM: everything is written in a single
+    transaction, the tests are looked up (and created if needed) together
+    by {@link _get_or_create_tests _get_or_create_tests}, and the rows are
+    written with batched inserts.  The test summaries are updated once per
+    test.</p>
+    
+    <p>The database assigns the result IDs (from the table's sequence,
+    where the database has one), so other connections may add results at
+    the same time.  After each batch of results rows is inserted, the new
+    IDs are read back by test and student name; see
+    {@link _insert_batch _insert_batch}.</p>
+    
+    @param bind The engine or connection of the database
+    @param items (test ID, student name, results) tuples, where the test ID
+                 is a {@link model.Test.id Test.id}
+    @type items iterable of tuple
+    @keyword batch_size The number of rows (results and questions) to
+                        write in each batch
+    @type batch_size int
+    @raises ValueError if another connection stores results for the same
+                       student and test during a batch
+    @return The number of results stored, the number of rows written and
+            the time taken (in seconds)
+    @returntype tuple
+    """
+    start = time.time()
+    items = list(items)
+    batch = []
+    batch_rows = 0
+    summary_changes = {}
+    connection = bind.connect()
+    transaction = connection.begin()
+    try:
+        test_oids, row_count = _get_or_create_tests(
+            connection, set(item[0] for item in items))
+        for test_id, student_name, results in items:
+            question_lists = ((CORRECT, results.correct or ()),
+                              (INCORRECT, results.incorrect or ()),
+                              (PENDING, results.pending or ()))
+            counts = tuple(len(question_ids)
+                           for status, question_ids in question_lists)
+            _add_summary_change(summary_changes,
+                                (test_oids[test_id],) + counts, 1)
+            batch.append((dict(test_id=test_oids[test_id],
+                               student_name=student_name,
+                               correct_count=counts[0],
+                               incorrect_count=counts[1],
+                               pending_count=counts[2]),
+                          question_lists))
+            batch_rows += 1 + sum(counts)
+            if batch_rows >= batch_size:
+                row_count += _insert_batch(connection, batch)
+                batch_rows = 0
+        row_count += _insert_batch(connection, batch)
+        _apply_summary_changes(connection, summary_changes)
+        transaction.commit()
+    except:
+        transaction.rollback()
+        raise
+    finally:
+        connection.close()
+    return len(items), row_count, time.time() - start
+
+def _find_result_ids(connection, keys, chunk_size=500):
+    """
+    Finds the IDs of the results for some students' tests.
+    
+    @param keys (test OID, student name) pairs
+    @type keys iterable of tuple
+    @return The result IDs for each pair, keyed by pair
+    @returntype dict
+    """
+    keys = set(keys)
+    test_ids = list(set(key[0] for key in keys))
+    names = list(set(key[1] for key in keys))
+    conditions = []
+    if None in names:
+        names.remove(None)
+        conditions.append(results_table.c.student_name == None)
+    # Keep the IN lists short enough for every database
+    for i in xrange(0, len(names), chunk_size):
+        conditions.append(
+            results_table.c.student_name.in_(names[i:i + chunk_size]))
+    result_ids = {}
+    for condition in conditions:
+        query = select([results_table.c.result_id,
+                        results_table.c.test_id,
+                        results_table.c.student_name],
+                       and_(results_table.c.test_id.in_(test_ids),
+                            condition))
+        for result_id, test_id, student_name in connection.execute(query):
+            key = (test_id, student_name)
+            if key in keys:
+                result_ids.setdefault(key, set()).add(result_id)
+    return result_ids
+
+def _insert_batch(connection, batch):
+    """
+    Inserts and then clears a batch of results.
+    
+    <p>The results rows are inserted all together and the database assigns
+    their IDs.  Those IDs can't be read back from a multi-row insert, so
+    the IDs of each (test, student name) pair are looked up before and
+    after the insert; the new ones, in ascending order, belong to that
+    pair's results in the order they were inserted.  The question rows are
+    then inserted with those IDs.</p>
+    
+    @param batch (results row, question lists) pairs, where the question
+                 lists are (status, question IDs) pairs
+    @type batch list of tuple
+    @raises ValueError if another connection stored results for the same
+                       student and test in the meantime
+    @return The number of rows inserted
+    @returntype int
+    """
+    if not batch:
+        return 0
+    keys = [(row['test_id'], row['student_name']) for row, lists in batch]
+    old_ids = _find_result_ids(connection, keys)
+    connection.execute(results_table.insert(),
+                       [row for row, lists in batch])
+    new_ids = {}
+    for key, result_ids in _find_result_ids(connection, keys).iteritems():
+        new_ids[key] = sorted(result_ids - old_ids.get(key, set()),
+                              reverse=True)
+    expected_counts = {}
+    for key in keys:
+        expected_counts[key] = expected_counts.get(key, 0) + 1
+    for key, expected_count in expected_counts.iteritems():
+        if len(new_ids.get(key, ())) != expected_count:
+            raise ValueError("Results were added by another connection "
+                             "during ingestion")
+    question_rows = []
+    for key, (row, question_lists) in zip(keys, batch):
+        result_id = new_ids[key].pop()
+        for status, question_ids in question_lists:
+            for position, question_id in enumerate(question_ids):
+                question_rows.append(dict(result_id=result_id,
+                                          status=status,
+                                          position=position,
+                                          question_id=question_id))
+    if question_rows:
+        connection.execute(result_questions_table.insert(), question_rows)
+    count = len(batch) + len(question_rows)
+    del batch[:]
+    return count
+
+### MIGRATION ###
+
+def migrate(bind):
+    """
+    Moves results stored in the old CSV columns into the
+    <code>result_questions</code> table, and builds the test summaries.
+    
+    Results that already have rows in the new table are left alone, so
+    running the migration again is harmless.  The old columns are left in
+    place (but no longer used), since not every database can drop columns.
+    
+    @param bind The engine or connection of the database to migrate
+    @return The number of results migrated
+    @returntype int
+    """
+    for table in (result_questions_table, test_summaries_table,
+                  score_counts_table):
+        table.create(bind=bind, checkfirst=True)
+    old_results = Table('results', MetaData(bind), autoload=True)
+    if 'correct_list' not in old_results.c:
+        # Created with the current schema
+        rebuild_summaries(bind)
+        return 0
+    connection = bind.connect()
+    transaction = connection.begin()
+    try:
+        migrated = set(row[0] for row in connection.execute(
+            select([result_questions_table.c.result_id], distinct=True)))
+        rows = []
+        result_count = 0
+        for row in connection.execute(select([
+                old_results.c.result_id, old_results.c.correct_list,
+                old_results.c.incorrect_list, old_results.c.pending_list])):
+            result_id = row[0]
+            if result_id in migrated:
+                continue
+            result_count += 1
+            for status, data in zip((CORRECT, INCORRECT, PENDING), row[1:]):
+                question_ids = PersistentResults._parse_list_data(data) or ()
+                for position, question_id in enumerate(question_ids):
+                    rows.append(dict(result_id=result_id, status=status,
+                                     position=position,
+                                     question_id=question_id))
+        if rows:
+            connection.execute(result_questions_table.insert(), rows)
+        transaction.commit()
+    except:
+        transaction.rollback()
+        raise
+    finally:
+        connection.close()
+    rebuild_summaries(bind)
+    return result_count
 
 ### MAPPERS ###
 
 mapper(TestRecord, tests_table, properties=dict(
     real_id=tests_table.c.test_real_id,
 ))
-mapper(PersistentResults, results_table, properties=dict(
+mapper(PersistentResults, results_table,
+       extension=_ResultsMapperExtension(), properties=dict(
     test=relation(TestRecord, backref='results'),
-    _correct_list=results_table.c.correct_list,
-    correct=synonym('_correct_list'),
+    # Loaded in the same query as the results, so reading the question
+    # lists of many results doesn't take a query each
+    _entries=relation(QuestionResult, backref='result', lazy=False,
+                      cascade='all, delete-orphan',
+                      order_by=[result_questions_table.c.status,
+                                result_questions_table.c.position]),
     correct_count=synonym('_correct_count', map_column=True),
-    _incorrect_list=results_table.c.incorrect_list,
-    incorrect=synonym('_incorrect_list'),
     incorrect_count=synonym('_incorrect_count', map_column=True),
-    _pending_list=results_table.c.pending_list,
-    pending=synonym('_pending_list'),
     pending_count=synonym('_pending_count', map_column=True),
 ))
+mapper(QuestionResult, result_questions_table)
+
+def _ingest_answer_files(url, test_id, key_path, patterns):
+    """Grades answer files and stores the results."""
+    import batch
+    import parse
+    key = model.AnswerKey(parse.parse_answers(key_path))
+    paths = []
+    for pattern in patterns:
+        paths.extend(batch.find_answer_files(pattern))
+    items = []
+    for path, answer_list, error in batch.iter_parse_answers(paths):
+        if error is not None:
+            print >> sys.stderr, "%s: %s" % (path, error)
+            continue
+        items.append((test_id, answer_list.student_name,
+                      model.Results.collect(key, answer_list)))
+    result_count, row_count, elapsed = ingest_results(create_engine(url),
+                                                      items)
+    rate = row_count / elapsed if elapsed > 0 else float('inf')
+    print ("Stored %d results (%d rows) in %.2f s (%.1f rows/s)"
+           % (result_count, row_count, elapsed, rate))
+
+def main(args=None):
+    """Runs a database maintenance command."""
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) == 2 and args[0] == 'migrate':
+        count = migrate(create_engine(args[1]))
+        print "Migrated %d results" % count
+        return 0
+    elif len(args) == 2 and args[0] == 'rebuild-summaries':
+        count = rebuild_summaries(create_engine(args[1]))
+        print "Summarized %d tests" % count
+        return 0
+    elif len(args) >= 5 and args[0] == 'ingest':
+        _ingest_answer_files(args[1], args[2], args[3], args[4:])
+        return 0
+    print >> sys.stderr, "usage: answerdb.py migrate DATABASE_URL"
+    print >> sys.stderr, "       answerdb.py rebuild-summaries DATABASE_URL"
+    print >> sys.stderr, ("       answerdb.py ingest DATABASE_URL TEST_ID "
+                          "KEY_FILE DIRECTORY_OR_GLOB ...")
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+#
+#   answerpack.py
+#   Educational toolkit
+#
+
+"""
+Compact binary format for answer lists.
+
+<p>A packed answer list holds the same information as the XML format read by
+{@link parse.parse_answers parse_answers}, laid out so that it can be loaded
+with a handful of bulk reads:</p>
+
+<ol>
+<li>The magic string <code>ETAL</code> and a format version byte</li>
+<li>The student name (a length-prefixed UTF-8 string, absent if the length
+    is <code>0xFFFFFFFF</code>)</li>
+<li>The answer count and the table of distinct question IDs</li>
+<li>For every answer, its index into the ID table</li>
+<li>Every answer's <code>time_taken</code> as a double</li>
+<li>The <code>hint_used</code> flags, eight to a byte</li>
+<li>Every answer's length in UTF-8 bytes, then all the answers' text</li>
+</ol>
+
+<p>All integers and doubles are little-endian.</p>
+"""
+
+from array import array
+from cStringIO import StringIO
+import struct
+import sys
+
+import model
+import parse
+
+__docformat__ = "JavaDoc"
+__all__ = ['MAGIC',
+           'VERSION',
+           'dump',
+           'dumps',
+           'load',
+           'loads',
+           'is_packed',
+           'convert',]
+
+MAGIC = 'ETAL'
+VERSION = 1
+_NONE_LENGTH = 0xFFFFFFFF
+_header = struct.Struct('<4sB')
+_uint = struct.Struct('<I')
+
+def _to_little_endian(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+def _write_string(out, value):
+    if value is None:
+        out.write(_uint.pack(_NONE_LENGTH))
+    else:
+        data = value.encode('utf-8')
+        out.write(_uint.pack(len(data)))
+        out.write(data)
+
+_hint_bits = [tuple(bool(byte & (1 << bit)) for bit in xrange(8))
+              for byte in xrange(256)]
+
+def _check_size(data, end):
+    if end > len(data):
+        raise ValueError("Truncated answer pack")
+
+def _unpack_uint(data, position):
+    end = position + _uint.size
+    _check_size(data, end)
+    return _uint.unpack_from(data, position)[0], end
+
+def _unpack_string(data, position):
+    """Unpacks a length-prefixed string, leaving it encoded."""
+    length, position = _unpack_uint(data, position)
+    if length == _NONE_LENGTH:
+        return None, position
+    end = position + length
+    _check_size(data, end)
+    return data[position:end], end
+
+def _unpack_array(data, position, typecode, count):
+    values = array(typecode)
+    end = position + values.itemsize * count
+    _check_size(data, end)
+    values.fromstring(data[position:end])
+    return _to_little_endian(values), end
+
+def _decode_all(strings):
+    """
+    Decodes many UTF-8 strings, with a single decode where possible.
+    
+    @param strings The encoded strings (<code>None</code> is left alone)
+    @type strings list of str
+    @returntype list of unicode
+    """
+    present = [value for value in strings if value is not None]
+    joined = '\0'.join(present)
+    if joined.count('\0') == max(len(present) - 1, 0):
+        decoded = iter(joined.decode('utf-8').split(u'\0'))
+    else:
+        # The strings themselves contain NULs
+        decoded = (value.decode('utf-8') for value in present)
+    return [decoded.next() if value is not None else None
+            for value in strings]
+
+def dump(answers, f):
+    """
+    Writes a list of answers in packed form.
+    
+    @param answers The answers to write
+    @type answers {@link model.AnswerList AnswerList}
+    @param f The file to write to
+    @type f file-like object
+    """
+    student_name = getattr(answers, 'student_name', None)
+    answers = list(answers)
+    count = len(answers)
+    qid_indices = {}
+    qids = []
+    index_data = array('I')
+    time_data = array('d')
+    hint_data = bytearray((count + 7) // 8)
+    length_data = array('I')
+    text_data = []
+    for i, answer in enumerate(answers):
+        # Intern question ID
+        try:
+            index = qid_indices[answer.id]
+        except KeyError:
+            index = qid_indices[answer.id] = len(qids)
+            qids.append(answer.id)
+        index_data.append(index)
+        time_data.append(answer.time_taken)
+        if answer.hint_used:
+            hint_data[i >> 3] |= 1 << (i & 7)
+        if answer.answer is None:
+            length_data.append(_NONE_LENGTH)
+        else:
+            text = answer.answer.encode('utf-8')
+            length_data.append(len(text))
+            text_data.append(text)
+    # Write out
+    f.write(_header.pack(MAGIC, VERSION))
+    _write_string(f, student_name)
+    f.write(_uint.pack(count))
+    f.write(_uint.pack(len(qids)))
+    for qid in qids:
+        _write_string(f, unicode(qid))
+    f.write(_to_little_endian(index_data).tostring())
+    f.write(_to_little_endian(time_data).tostring())
+    f.write(str(hint_data))
+    f.write(_to_little_endian(length_data).tostring())
+    f.write(''.join(text_data))
+
+def dumps(answers):
+    """
+    Packs a list of answers.
+    
+    @param answers The answers to pack
+    @type answers {@link model.AnswerList AnswerList}
+    @return The packed answers
+    @returntype str
+    """
+    out = StringIO()
+    dump(answers, out)
+    return out.getvalue()
+
+def load(f):
+    """
+    Reads a packed list of answers.
+    
+    The rest of the file is read, so it must hold nothing but the answers.
+    
+    @param f The file to read from
+    @type f file-like object
+    @raises ValueError if the data is not a packed answer list
+    @return The answers
+    @returntype {@link model.AnswerList AnswerList}
+    """
+    return loads(f.read())
+
+def loads(data):
+    """
+    Unpacks a list of answers.
+    
+    @param data The packed answers
+    @type data str
+    @raises ValueError if the data is not a packed answer list
+    @return The answers
+    @returntype {@link model.AnswerList AnswerList}
+    """
+    _check_size(data, _header.size)
+    magic, version = _header.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not an answer pack")
+    if version != VERSION:
+        raise ValueError("Unsupported answer pack version: %d" % version)
+    position = _header.size
+    student_name, position = _unpack_string(data, position)
+    count, position = _unpack_uint(data, position)
+    qid_count, position = _unpack_uint(data, position)
+    # One unpack per ID, without a function call for each
+    qids = []
+    unpack_uint = _uint.unpack_from
+    try:
+        for i in xrange(qid_count):
+            length = unpack_uint(data, position)[0]
+            position += _uint.size
+            if length == _NONE_LENGTH:
+                qids.append(None)
+            else:
+                end = position + length
+                qids.append(data[position:end])
+                position = end
+    except struct.error:
+        raise ValueError("Truncated answer pack")
+    _check_size(data, position)
+    qids = _decode_all(qids)
+    index_data, position = _unpack_array(data, position, 'I', count)
+    time_data, position = _unpack_array(data, position, 'd', count)
+    hint_size = (count + 7) // 8
+    _check_size(data, position + hint_size)
+    hints = []
+    for byte in bytearray(data[position:position + hint_size]):
+        hints.extend(_hint_bits[byte])
+    position += hint_size
+    length_data, position = _unpack_array(data, position, 'I', count)
+    texts = []
+    for length in length_data:
+        if length == _NONE_LENGTH:
+            texts.append(None)
+        else:
+            end = position + length
+            texts.append(data[position:end])
+            position = end
+    _check_size(data, position)
+    if position != len(data):
+        raise ValueError("Trailing data after answer pack")
+    # Build answers
+    answers = map(model.Answer, [qids[index] for index in index_data],
+                  _decode_all(texts), time_data, hints[:count])
+    if student_name is not None:
+        student_name = student_name.decode('utf-8')
+    return model.AnswerList(answers, student_name)
+
+def is_packed(path):
+    """
+    Checks whether a file is a packed answer list.
+    
+    @param path The file to check
+    @type path str
+    @returntype bool
+    """
+    f = open(path, 'rb')
+    try:
+        return f.read(len(MAGIC)) == MAGIC
+    finally:
+        f.close()
+
+def convert(source_path, dest_path):
+    """
+    Converts an answer file between the XML and packed formats.
+    
+    The direction of the conversion is decided by the format of the source
+    file.
+    
+    @param source_path The file to convert
+    @type source_path str
+    @param dest_path The file to write the converted answers to
+    @type dest_path str
+    """
+    if is_packed(source_path):
+        f = open(source_path, 'rb')
+        try:
+            answers = load(f)
+        finally:
+            f.close()
+        f = open(dest_path, 'wb')
+        try:
+            parse.write_answers(answers, f)
+        finally:
+            f.close()
+    else:
+        answers = parse.parse_answers(source_path)
+        f = open(dest_path, 'wb')
+        try:
+            dump(answers, f)
+        finally:
+            f.close()
+
+def main(args=None):
+    """Converts an answer file between the XML and packed formats."""
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) != 2:
+        print >> sys.stderr, "usage: answerpack.py source dest"
+        return 1
+    convert(args[0], args[1])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
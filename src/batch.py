@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+#
+#   batch.py
+#   Educational toolkit
+#
+
+"""Batch ingestion of student answer files"""
+
+from glob import glob
+from multiprocessing import Pool
+from optparse import OptionParser
+import os
+import sys
+import time
+
+import parse
+
+__docformat__ = "JavaDoc"
+__all__ = ['find_answer_files',
+           'iter_parse_answers',
+           'parse_answer_files',]
+
+def find_answer_files(pattern):
+    """
+    Finds the answer files named by a directory or glob pattern.
+    
+    @param pattern A directory (all of its <code>.xml</code> files are used)
+                   or a glob pattern
+    @type pattern str
+    @return The matching paths, sorted
+    @returntype list of str
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.xml')
+    return sorted(glob(pattern))
+
+def _parse_answer_file(path):
+    """
+    Parses a single answer file in a worker process.
+    
+    @return (path, answer list, error message) -- exactly one of the answer
+            list and the error message is <code>None</code>
+    @returntype tuple
+    """
+    try:
+        return (path, parse.parse_answers(path), None)
+    except Exception, e:
+        return (path, None, "%s: %s" % (type(e).__name__, e))
+
+def iter_parse_answers(paths, processes=None, chunksize=8):
+    """
+    Parses many answer files across a pool of processes.
+    
+    Results are yielded in the same order as <code>paths</code>, as soon as
+    they (and every result before them) are ready.  A file that fails to
+    parse does not stop the batch; its error is reported in its result
+    instead.
+    
+    @param paths The answer files to parse
+    @type paths iterable of str
+    @keyword processes The number of worker processes (defaults to the number
+                       of CPUs)
+    @type processes int
+    @keyword chunksize The number of files sent to a worker at a time
+    @type chunksize int
+    @return (path, answer list, error message) tuples -- exactly one of the
+            answer list and the error message is <code>None</code>
+    @returntype iterator of tuple
+    """
+    pool = Pool(processes)
+    try:
+        for result in pool.imap(_parse_answer_file, paths, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def parse_answer_files(pattern, processes=None):
+    """
+    Parses every answer file named by a directory or glob pattern.
+    
+    @param pattern A directory or glob pattern
+    @type pattern str
+    @keyword processes The number of worker processes (defaults to the number
+                       of CPUs)
+    @type processes int
+    @return The parsed answers and a dictionary of errors keyed by path
+    @returntype tuple of (list of {@link model.AnswerList AnswerList}, dict)
+    @see find_answer_files
+    """
+    answer_lists = []
+    errors = {}
+    paths = find_answer_files(pattern)
+    for path, answer_list, error in iter_parse_answers(paths, processes):
+        if error is None:
+            answer_lists.append(answer_list)
+        else:
+            errors[path] = error
+    return answer_lists, errors
+
+def main(args=None):
+    """Parses answer files and reports throughput."""
+    option_parser = OptionParser(
+        usage="%prog [options] DIRECTORY_OR_GLOB ...")
+    option_parser.add_option('-j', '--processes', type='int', default=None,
+                             help="number of worker processes "
+                                  "(default: number of CPUs)")
+    option_parser.add_option('-q', '--quiet', action='store_true',
+                             default=False,
+                             help="don't list each file")
+    options, args = option_parser.parse_args(args)
+    if not args:
+        option_parser.error("no answer files given")
+    paths = []
+    for pattern in args:
+        paths.extend(find_answer_files(pattern))
+    # Parse files
+    error_count = 0
+    start = time.time()
+    for path, answer_list, error in iter_parse_answers(paths,
+                                                       options.processes):
+        if error is not None:
+            error_count += 1
+            print >> sys.stderr, "%s: %s" % (path, error)
+        elif not options.quiet:
+            print "%s: %s (%d answers)" % (path, answer_list.student_name,
+                                           len(answer_list))
+    elapsed = time.time() - start
+    # Report
+    rate = len(paths) / elapsed if elapsed > 0 else float('inf')
+    print >> sys.stderr, ("Parsed %d files (%d errors) in %.2f s "
+                          "(%.1f files/s)" % (len(paths), error_count,
+                                              elapsed, rate))
+    if error_count:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
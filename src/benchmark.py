@@ -0,0 +1,609 @@
+#!/usr/bin/env python
+#
+#   benchmark.py
+#   Educational toolkit
+#
+
+"""Benchmarks for the parser and grader"""
+
+from base64 import b64encode
+from cStringIO import StringIO
+from gzip import GzipFile
+try:
+    import json
+except ImportError:
+    import simplejson as json
+from multiprocessing import Pool
+from optparse import OptionParser
+import random
+import resource
+import struct
+import sys
+import time
+from xml.dom import minidom
+from xml.sax.saxutils import escape, quoteattr
+
+import model
+import parse
+try:
+    import grading
+except ImportError:
+    # NumPy is not installed
+    grading = None
+
+__docformat__ = "JavaDoc"
+__all__ = ['generate_test',
+           'generate_answers',
+           'time_call',
+           'run_suite',
+           'compare_decoders',
+           'compare_image_workers',
+           'measure_object_sizes',]
+
+_question_types = ('short_answer', 'multiple_choice', 'true_false',
+                   'matching', 'flashcard')
+_difficulties = (u"Easy", u"Medium", u"Hard")
+
+def _generate_image_data(index, size, rng):
+    """
+    Generates the contents of an embedded image element.
+    
+    @return The base64-encoded, gzipped data
+    @returntype str
+    """
+    data = struct.pack('<I', index) + ''.join(chr(rng.randrange(256))
+                                              for i in xrange(size - 4))
+    buf = StringIO()
+    gzip_file = GzipFile(fileobj=buf, mode='wb')
+    gzip_file.write(data)
+    gzip_file.close()
+    return b64encode(buf.getvalue())
+
+def generate_test(question_count, seed=0, type_mix=None, image_count=0,
+                  image_size=4096, blank_density=1.0 / 3):
+    """
+    Generates the XML of a synthetic test.
+    
+    @param question_count The number of questions to generate
+    @type question_count int
+    @keyword seed The seed for the random number generator
+    @type seed int
+    @keyword type_mix The relative weight of each question type (by its XML
+                      name).  By default, the types are used in turn.
+    @type type_mix dict
+    @keyword image_count The number of embedded images, spread evenly across
+                         the questions
+    @type image_count int
+    @keyword image_size The size of each image (in bytes, before
+                        compression)
+    @type image_size int
+    @keyword blank_density The fraction of questions with a blank in their
+                           text
+    @type blank_density float
+    @return The test document
+    @returntype str
+    """
+    rng = random.Random(seed)
+    if type_mix:
+        mix_types = sorted(type_mix)
+        mix_total = float(sum(type_mix.values()))
+    out = StringIO()
+    out.write('<?xml version="1.0"?>\n<test id="Generated%d">\n'
+              % question_count)
+    out.write('    <instructions>Answer every question.</instructions>\n')
+    image_index = 0
+    for i in xrange(question_count):
+        if type_mix:
+            point = rng.random() * mix_total
+            for qtype in mix_types:
+                point -= type_mix[qtype]
+                if point < 0:
+                    break
+        else:
+            qtype = _question_types[i % len(_question_types)]
+        out.write('    <question id="Q%05d" type="%s">\n' % (i, qtype))
+        out.write('        <credits>%d</credits>\n' % rng.randint(1, 10))
+        if rng.random() < blank_density:
+            out.write('        <text>Question %d has a <blank length="%d" />'
+                      ' in it.</text>\n' % (i, rng.randint(2, 12)))
+        else:
+            out.write('        <text>Question %d: %s</text>\n'
+                      % (i, escape('What is %d + %d?' % (i, i))))
+        out.write('        <difficulty>%s</difficulty>\n'
+                  % rng.choice(_difficulties))
+        out.write('        <hint>Think about it.</hint>\n')
+        out.write('        <average-time>%.1f</average-time>\n'
+                  % rng.uniform(5, 120))
+        out.write('        <stipulated-time>120</stipulated-time>\n')
+        if qtype == 'short_answer':
+            out.write('        <expected-length>%d</expected-length>\n'
+                      % rng.randint(1, 20))
+        elif qtype == 'multiple_choice':
+            for name in 'abcd':
+                out.write('        <choice name=%s>Choice %s</choice>\n'
+                          % (quoteattr(name), name))
+        elif qtype == 'matching':
+            for j in xrange(4):
+                out.write('        <key>Key %d</key>\n' % j)
+            for j in xrange(4):
+                out.write('        <answer>Answer %d</answer>\n' % j)
+        elif qtype == 'flashcard':
+            out.write('        <back-text>The back of card %d</back-text>\n'
+                      % i)
+        # Spread images evenly
+        while image_index < image_count * (i + 1) // question_count:
+            out.write('        <img type="image/png" title="Image %d">%s'
+                      '</img>\n' % (image_index,
+                                    _generate_image_data(image_index,
+                                                         image_size, rng)))
+            image_index += 1
+        out.write('    </question>\n')
+    out.write('</test>\n')
+    return out.getvalue()
+
+def generate_answers(test, student_count, correct_rate=0.7, seed=0):
+    """
+    Generates an answer key and student answers for a test.
+    
+    @param test The test to answer
+    @type test {@link model.Test Test}
+    @param student_count The number of students to generate answers for
+    @type student_count int
+    @keyword correct_rate The probability of each student answer being
+                          correct
+    @type correct_rate float
+    @keyword seed The seed for the random number generator
+    @type seed int
+    @return The answer key and the students' answers
+    @returntype tuple of (list of {@link model.Answer Answer},
+                list of {@link model.AnswerList AnswerList})
+    """
+    rng = random.Random(seed)
+    key = []
+    for question in test.questions:
+        if isinstance(question, model.FlashCard):
+            continue
+        elif isinstance(question, model.MultipleChoiceQuestion):
+            answer = question.choices[0][0]
+        elif isinstance(question, model.TrueFalseQuestion):
+            answer = u"true"
+        elif isinstance(question, model.MatchingQuestion):
+            answer = dict((i, i) for i in xrange(len(question.keys)))
+        else:
+            answer = u"%d" % rng.randint(0, 99)
+        key.append(question.answer(answer, 1.0))
+    answer_lists = []
+    for i in xrange(student_count):
+        answers = []
+        for key_answer in key:
+            if rng.random() < correct_rate:
+                text = key_answer.answer
+            else:
+                text = u"wrong"
+            answers.append(model.Answer(key_answer.id, text,
+                                        rng.uniform(1, 120),
+                                        rng.random() < 0.2))
+        answer_lists.append(model.AnswerList(answers, u"Student %d" % i))
+    return key, answer_lists
+
+def time_call(func, *args, **kw):
+    """
+    Times a function call.
+    
+    @param func The function to call
+    @type func callable
+    @keyword repeat The number of times to call the function (default 3)
+    @type repeat int
+    @return The fastest time of the calls (in seconds)
+    @returntype float
+    """
+    repeat = kw.pop('repeat', 3)
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        func(*args, **kw)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+class _LegacyTestParser(parse.TestParser):
+    """
+    The question decoder used before the single-pass decoder, for comparison.
+    
+    Each field is found with a recursive <code>getElementsByTagName</code>
+    search of the question element.
+    """
+    def _build_question(self, elem):
+        def get_child_text(name):
+            results = elem.getElementsByTagName(name)
+            if results:
+                return parse._get_text(results[0])
+            return None
+        qtypes = {'short_answer': model.ShortAnswerQuestion,
+                  'multiple_choice': model.MultipleChoiceQuestion,
+                  'true_false': model.TrueFalseQuestion,
+                  'matching': model.MatchingQuestion,
+                  'flashcard': model.FlashCard,}
+        question_id = elem.getAttribute('id')
+        question_type = qtypes[elem.getAttribute('type')]
+        credits = get_child_text('credits')
+        if credits is not None:
+            credits = int(credits)
+        text = self._parse_question_text(elem.getElementsByTagName('text')[0])
+        difficulty = get_child_text('difficulty')
+        advice = get_child_text('advice')
+        hint = get_child_text('hint')
+        average_time = get_child_text('average-time')
+        if average_time is not None:
+            average_time = float(average_time)
+        stipulated_time = get_child_text('stipulated-time')
+        if stipulated_time is not None:
+            stipulated_time = float(stipulated_time)
+        if issubclass(question_type, model.MultipleChoiceQuestion):
+            choices = [(e.getAttribute('name'), parse._get_text(e))
+                       for e in elem.getElementsByTagName('choice')]
+            question = question_type(question_id, text, choices,
+                                     credits, difficulty)
+        elif issubclass(question_type, model.ShortAnswerQuestion):
+            expected_length = int(get_child_text('expected-length'))
+            question = question_type(question_id, text, expected_length,
+                                     credits, difficulty)
+        elif issubclass(question_type, model.MatchingQuestion):
+            keys = [parse._get_text(e)
+                    for e in elem.getElementsByTagName('key')]
+            answers = [parse._get_text(e)
+                       for e in elem.getElementsByTagName('answer')]
+            question = question_type(question_id, text, keys, answers,
+                                     credits, difficulty)
+        elif issubclass(question_type, model.FlashCard):
+            back_text = get_child_text('back-text')
+            question = question_type(question_id, text, back_text,
+                                     credits, difficulty)
+        else:
+            question = question_type(question_id, text, credits, difficulty)
+        question.advice = advice
+        question.hint = hint
+        question.average_time = average_time
+        question.stipulated_time = stipulated_time
+        for child in elem.childNodes:
+            if child.nodeType == minidom.Node.ELEMENT_NODE:
+                if child.tagName == 'img':
+                    question.images.append(self._handle_image(child))
+                elif child.tagName == 'image-page':
+                    question.images.append(self._handle_image_page(child))
+        return question
+
+def compare_decoders(question_counts=(1000, 2000, 5000)):
+    """
+    Compares the legacy and single-pass question decoders.
+    
+    Only the decoding is timed; each document is parsed into a DOM
+    beforehand.
+    
+    @keyword question_counts The test sizes to try
+    @type question_counts sequence of int
+    @return (question count, legacy time, new time) tuples
+    @returntype list of tuple
+    """
+    results = []
+    for count in question_counts:
+        doc = minidom.parseString(generate_test(count))
+        legacy_time = time_call(_LegacyTestParser().parse, doc)
+        new_time = time_call(parse.TestParser().parse, doc)
+        results.append((count, legacy_time, new_time))
+        doc.unlink()
+    return results
+
+def _load_with_images(test_xml, image_workers):
+    test = parse.parse_test(StringIO(test_xml),
+                            parser=parse.TestParser(image_workers))
+    for question in test.questions:
+        for image in question.images:
+            image.get_source()
+
+def compare_image_workers(worker_counts=(0, 1, 2, 4), question_count=200,
+                          image_count=200, image_size=64 * 1024):
+    """
+    Compares test load times with different numbers of image decoding
+    threads.
+    
+    The time includes parsing the test and waiting for every image to be
+    decoded.
+    
+    @keyword worker_counts The numbers of threads to try
+    @type worker_counts sequence of int
+    @return (worker count, time) tuples
+    @returntype list of tuple
+    """
+    test_xml = generate_test(question_count, image_count=image_count,
+                             image_size=image_size)
+    return [(workers, time_call(_load_with_images, test_xml, workers))
+            for workers in worker_counts]
+
+class _DictRecord(object):
+    """An object with a per-instance attribute dictionary, for comparison."""
+    def __init__(self, **attrs):
+        for name, value in attrs.iteritems():
+            setattr(self, name, value)
+
+def _as_dict_record(obj):
+    names = [name for cls in type(obj).__mro__
+             for name in getattr(cls, '__slots__', ())]
+    return _DictRecord(**dict((name, getattr(obj, name)) for name in names))
+
+def _get_object_size(obj):
+    """
+    Computes the size of an object and its attribute dictionary (if any).
+    
+    The attribute values themselves are not counted, since they are the same
+    for every representation.
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def measure_object_sizes():
+    """
+    Compares the per-instance size of model objects with and without
+    <code>__slots__</code>.
+    
+    @return (class name, size with a dictionary, size with slots) tuples,
+            with sizes in bytes
+    @returntype list of tuple
+    """
+    objects = [model.Answer(u"Q00001", u"An answer", 12.5, False),
+               model.Blank(),
+               model.ShortAnswerQuestion(u"Q00001", model.QuestionText(), 10,
+                                         1)]
+    return [(type(obj).__name__, _get_object_size(_as_dict_record(obj)),
+             _get_object_size(obj)) for obj in objects]
+
+# SUITE #
+
+def _bench_parse_test(test_xml):
+    parse.parse_test(StringIO(test_xml))
+
+def _bench_parse_answers(answer_xmls):
+    for answer_xml in answer_xmls:
+        parse.parse_answers(StringIO(answer_xml))
+
+def _bench_serialize_answers(answer_lists):
+    for answer_list in answer_lists:
+        parse.serialize_answers(answer_list).toxml()
+
+def _bench_write_answers(answer_lists):
+    for answer_list in answer_lists:
+        parse.write_answers(answer_list, StringIO())
+
+def _bench_collect(key, answer_lists):
+    for answer_list in answer_lists:
+        model.Results.collect(key, answer_list)
+
+def _bench_grade_class(key, answer_lists):
+    grading.grade_class(key, answer_lists)
+
+def _peak_memory():
+    """
+    Retrieves the peak resident memory of the current process (in
+    kilobytes).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _run_case(func, args, repeat):
+    """
+    Times a benchmark in a worker process.
+    
+    @return The fastest time and how much the benchmark raised the process's
+            peak memory (in kilobytes)
+    @returntype tuple
+    """
+    before = _peak_memory()
+    elapsed = time_call(func, repeat=repeat, *args)
+    return elapsed, _peak_memory() - before
+
+def _get_config(question_count, student_count, type_mix, image_count,
+                image_size, blank_density, seed):
+    """
+    Gets the configuration of the generated benchmark inputs.
+    
+    Reports are only comparable if their configurations are the same.
+    
+    @returntype dict
+    """
+    return dict(question_count=question_count, student_count=student_count,
+                type_mix=type_mix, image_count=image_count,
+                image_size=image_size, blank_density=blank_density,
+                seed=seed)
+
+def run_suite(question_count=500, student_count=200, type_mix=None,
+              image_count=0, image_size=4096, blank_density=1.0 / 3,
+              repeat=3, seed=0):
+    """
+    Runs the parser and grader benchmarks.
+    
+    <p>Each benchmark runs in a fresh process, so its peak memory is not
+    hidden by an earlier benchmark's.  The inputs are generated up front and
+    passed to the process before timing begins.</p>
+    
+    @keyword question_count The number of questions on the test
+    @type question_count int
+    @keyword student_count The number of answer lists
+    @type student_count int
+    @keyword repeat The number of times to run each benchmark (the fastest run
+                    is reported)
+    @type repeat int
+    @return The configuration and a result for each benchmark, ready to be
+            saved as JSON
+    @returntype dict
+    @see generate_test
+    """
+    config = _get_config(question_count, student_count, type_mix,
+                         image_count, image_size, blank_density, seed)
+    config['repeat'] = repeat
+    # Generate inputs
+    test_xml = generate_test(question_count, seed, type_mix, image_count,
+                             image_size, blank_density)
+    test = parse.parse_test(StringIO(test_xml))
+    key, answer_lists = generate_answers(test, student_count, seed=seed)
+    answer_xmls = []
+    for answer_list in answer_lists:
+        buf = StringIO()
+        parse.write_answers(answer_list, buf)
+        answer_xmls.append(buf.getvalue())
+    answer_count = sum(len(answer_list) for answer_list in answer_lists)
+    cases = [('parse_test', _bench_parse_test, (test_xml,),
+              question_count),
+             ('parse_answers', _bench_parse_answers, (answer_xmls,),
+              answer_count),
+             ('serialize_answers', _bench_serialize_answers,
+              (answer_lists,), answer_count),
+             ('write_answers', _bench_write_answers, (answer_lists,),
+              answer_count),
+             ('Results.collect', _bench_collect, (key, answer_lists),
+              answer_count),]
+    if grading is not None:
+        cases.append(('grade_class', _bench_grade_class,
+                      (key, answer_lists), answer_count))
+    # Run benchmarks
+    results = {}
+    for name, func, args, item_count in cases:
+        pool = Pool(1)
+        try:
+            elapsed, peak_memory = pool.apply(_run_case,
+                                              (func, args, repeat))
+        finally:
+            pool.terminate()
+            pool.join()
+        results[name] = dict(seconds=elapsed, items=item_count,
+                             items_per_second=item_count / elapsed,
+                             peak_memory_kb=peak_memory)
+    return dict(config=config, results=results,
+                python=sys.version.split()[0],
+                date=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+def _print_report(report, baseline=None):
+    print "%-20s %10s %14s %12s %10s" % ("benchmark", "time (s)", "items/s",
+                                         "peak (KiB)", "vs base")
+    for name in sorted(report['results']):
+        result = report['results'][name]
+        ratio = ''
+        if baseline is not None and name in baseline['results']:
+            ratio = '%.2fx' % (baseline['results'][name]['seconds'] /
+                               result['seconds'])
+        print "%-20s %10.4f %14.1f %12d %10s" % (name, result['seconds'],
+                                                 result['items_per_second'],
+                                                 result['peak_memory_kb'],
+                                                 ratio)
+
+def main(args=None):
+    """Runs the benchmark suite."""
+    option_parser = OptionParser(usage="%prog [options]")
+    option_parser.add_option('-n', '--questions', type='int', default=500,
+                             help="questions on the test (default: 500)")
+    option_parser.add_option('-s', '--students', type='int', default=200,
+                             help="answer lists to generate (default: 200)")
+    option_parser.add_option('-m', '--type-mix', default=None,
+                             metavar='TYPE=WEIGHT,...',
+                             help="relative weights of the question types")
+    option_parser.add_option('-i', '--images', type='int', default=0,
+                             help="embedded images on the test")
+    option_parser.add_option('--image-size', type='int', default=4096,
+                             help="bytes per image (default: 4096)")
+    option_parser.add_option('-b', '--blank-density', type='float',
+                             default=1.0 / 3,
+                             help="fraction of questions with a blank")
+    option_parser.add_option('-r', '--repeat', type='int', default=3,
+                             help="runs per benchmark (default: 3)")
+    option_parser.add_option('-o', '--output', default=None,
+                             help="save the results as JSON")
+    option_parser.add_option('-c', '--compare', default=None,
+                             metavar='JSON_FILE',
+                             help="compare with previously saved results")
+    option_parser.add_option('--decoders', action='store_true',
+                             default=False,
+                             help="compare the legacy and current question "
+                                  "decoders instead")
+    option_parser.add_option('--image-workers', default=None,
+                             metavar='COUNT,...',
+                             help="compare load times with these numbers of "
+                                  "image decoding threads instead")
+    option_parser.add_option('--object-sizes', action='store_true',
+                             default=False,
+                             help="compare the memory used per model object "
+                                  "with and without __slots__ instead")
+    options, args = option_parser.parse_args(args)
+    if args:
+        option_parser.error("unexpected arguments")
+    if options.object_sizes:
+        print "%-20s %12s %12s" % ("class", "dict (B)", "slots (B)")
+        for name, dict_size, slots_size in measure_object_sizes():
+            print "%-20s %12d %12d" % (name, dict_size, slots_size)
+        return 0
+    if options.image_workers:
+        try:
+            worker_counts = [int(count)
+                             for count in options.image_workers.split(',')]
+        except ValueError:
+            option_parser.error("invalid worker counts: %s"
+                                % options.image_workers)
+        print "%8s %10s" % ("workers", "time (s)")
+        for workers, elapsed in compare_image_workers(
+                worker_counts, options.questions, options.images or 200,
+                options.image_size):
+            print "%8d %10.4f" % (workers, elapsed)
+        return 0
+    if options.decoders:
+        print "%10s %12s %12s %8s" % ("questions", "legacy (s)", "new (s)",
+                                      "speedup")
+        counts = (options.questions, options.questions * 2,
+                  options.questions * 4)
+        for count, legacy_time, new_time in compare_decoders(counts):
+            print "%10d %12.4f %12.4f %7.1fx" % (count, legacy_time, new_time,
+                                                 legacy_time / new_time)
+        return 0
+    type_mix = None
+    if options.type_mix:
+        try:
+            type_mix = {}
+            for item in options.type_mix.split(','):
+                qtype, weight = item.split('=')
+                type_mix[qtype] = float(weight)
+        except ValueError:
+            option_parser.error("invalid type mix: %s" % options.type_mix)
+        unknown_types = sorted(set(type_mix) - set(_question_types))
+        if unknown_types:
+            option_parser.error("unknown question types: %s (choose from %s)"
+                                % (', '.join(unknown_types),
+                                   ', '.join(_question_types)))
+    baseline = None
+    if options.compare:
+        f = open(options.compare)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        # Round-trip through JSON so the types match the saved report's
+        config = json.loads(json.dumps(_get_config(
+            options.questions, options.students, type_mix, options.images,
+            options.image_size, options.blank_density, 0)))
+        baseline_config = dict(baseline.get('config', {}))
+        baseline_config.pop('repeat', None)
+        if config != baseline_config:
+            option_parser.error("%s was generated with a different "
+                                "configuration" % options.compare)
+    report = run_suite(options.questions, options.students, type_mix,
+                       options.images, options.image_size,
+                       options.blank_density, options.repeat)
+    _print_report(report, baseline)
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            json.dump(report, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+#   grading.py
+#   Educational toolkit
+#
+
+"""Vectorized grading of a whole class at once"""
+
+import numpy
+
+import model
+
+__docformat__ = "JavaDoc"
+__all__ = ['CORRECT',
+           'INCORRECT',
+           'PENDING',
+           'UNANSWERED',
+           'encode_answers',
+           'grade_class',]
+
+CORRECT = 1
+INCORRECT = 0
+PENDING = -1
+UNANSWERED = -2
+
+_NO_KEY = -1
+
+def encode_answers(key, answer_lists):
+    """
+    Encodes a class's answers as integer codes.
+    
+    <p>Every distinct answer to a question is given a small integer code,
+    with <code>0</code> reserved for the answer key's answer.  The columns
+    are the question IDs in the key (in order), followed by any other
+    question IDs the students answered, in the order they were first seen.
+    If a student answered a question more than once, the first answer is
+    used, like {@link model.AnswerList.get_answer get_answer} does.</p>
+    
+    @param key The machine gradeable answer key
+    @type key dict/list of {@link model.Answer Answers}
+    @param answer_lists The students' answers
+    @type answer_lists list of {@link model.AnswerList AnswerLists}
+    @return The question IDs of the columns, the students &times; questions
+            answer codes (<code>-1</code> where a question was not
+            answered) and the key's code for each question (<code>-1</code>
+            where the key has no answer)
+    @returntype tuple of (list of str, <code>numpy.ndarray</code>,
+                <code>numpy.ndarray</code>)
+    """
+    if isinstance(key, dict):
+        key = key.values()
+    question_ids = []
+    columns = {}
+    codebooks = []
+    key_codes = []
+    for answer in key:
+        if answer.id in columns:
+            continue
+        columns[answer.id] = len(question_ids)
+        question_ids.append(answer.id)
+        codebooks.append({answer.answer: 0})
+        key_codes.append(0)
+    # Encode answers, a row at a time
+    rows = []
+    for answer_list in answer_lists:
+        row = [-1] * len(question_ids)
+        for answer in answer_list:
+            col = columns.get(answer.id)
+            if col is None:
+                # Not in the answer key
+                col = columns[answer.id] = len(question_ids)
+                question_ids.append(answer.id)
+                codebooks.append({})
+                key_codes.append(_NO_KEY)
+                row.append(-1)
+            elif row[col] >= 0:
+                # Already answered
+                continue
+            codebook = codebooks[col]
+            code = codebook.get(answer.answer)
+            if code is None:
+                code = codebook[answer.answer] = len(codebook)
+            row[col] = code
+        rows.append(row)
+    # Build arrays
+    width = len(question_ids)
+    for row in rows:
+        if len(row) < width:
+            row.extend([-1] * (width - len(row)))
+    answer_codes = numpy.array(rows, dtype=numpy.int32)
+    answer_codes.shape = (len(rows), width)
+    return (question_ids, answer_codes,
+            numpy.array(key_codes, dtype=numpy.int32))
+
+def grade_class(key, answer_lists, results_class=model.Results):
+    """
+    Grades every student in a class against one answer key.
+    
+    <p>This gives the same results as calling
+    {@link model.Results.collect Results.collect} for each student, but the
+    answers are compared with array operations over the whole class.  In the
+    results, question IDs are listed in column order rather than in the
+    order the student answered them.</p>
+    
+    @param key The machine gradeable answer key
+    @type key dict/list of {@link model.Answer Answers}
+    @param answer_lists The students' answers
+    @type answer_lists list of {@link model.AnswerList AnswerLists}
+    @keyword results_class The type of results to create
+    @type results_class type
+    @return The question IDs of the columns, a results object for each
+            student and the students &times; questions grade matrix (made of
+            {@link CORRECT CORRECT}, {@link INCORRECT INCORRECT},
+            {@link PENDING PENDING} and {@link UNANSWERED UNANSWERED})
+    @returntype tuple of (list of str, list of
+                {@link model.Results Results}, <code>numpy.ndarray</code>)
+    @see encode_answers
+    """
+    answer_lists = list(answer_lists)
+    question_ids, answer_codes, key_codes = encode_answers(key, answer_lists)
+    # Grade
+    answered = answer_codes >= 0
+    has_key = key_codes >= 0
+    matrix = numpy.empty(answer_codes.shape, dtype=numpy.int8)
+    matrix.fill(UNANSWERED)
+    matrix[answered & has_key] = INCORRECT
+    matrix[answered & (answer_codes == key_codes)] = CORRECT
+    matrix[answered & ~has_key] = PENDING
+    # Split into results, one status at a time
+    qid_array = numpy.empty(len(question_ids), dtype=object)
+    qid_array[:] = question_ids
+    student_count = len(answer_lists)
+    status_lists = []
+    for status in (CORRECT, INCORRECT, PENDING):
+        rows, cols = numpy.nonzero(matrix == status)
+        ids = qid_array[cols].tolist()
+        ends = numpy.bincount(rows, minlength=student_count).cumsum()
+        starts = [0] + ends[:-1].tolist()
+        status_lists.append([ids[start:end] for start, end
+                             in zip(starts, ends.tolist())])
+    results = [results_class(correct, incorrect, pending)
+               for correct, incorrect, pending in zip(*status_lists)]
+    return question_ids, results, matrix
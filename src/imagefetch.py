@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+#
+#   imagefetch.py
+#   Educational toolkit
+#
+
+"""Caching HTTP fetcher for linked images"""
+
+from cStringIO import StringIO
+from email.utils import parsedate_tz, mktime_tz
+import errno
+from hashlib import sha1
+import httplib
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import os
+from Queue import Queue, Empty
+import socket
+from tempfile import mkstemp
+import threading
+import time
+from urlparse import urljoin, urlsplit
+
+__docformat__ = "JavaDoc"
+__all__ = ['DEFAULT_CACHE_DIR',
+           'ImageFetcher',]
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'),
+                                 '.educationaltoolkit', 'image-cache')
+_MAX_REDIRECTS = 5
+
+def _parse_cache_control(value):
+    """
+    Parses a <code>Cache-Control</code> header.
+    
+    @return The directives, with <code>None</code> as the value of those
+            without arguments
+    @returntype dict
+    """
+    directives = {}
+    for item in (value or '').split(','):
+        item = item.strip().lower()
+        if not item:
+            continue
+        if '=' in item:
+            name, arg = item.split('=', 1)
+            directives[name.strip()] = arg.strip().strip('"')
+        else:
+            directives[item] = None
+    return directives
+
+def _parse_http_date(value):
+    if not value:
+        return None
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return mktime_tz(parsed)
+
+class ImageFetcher(object):
+    """
+    Fetches linked images over HTTP, keeping a persistent cache.
+    
+    <p>Responses are cached on disk along with their <code>ETag</code>,
+    <code>Last-Modified</code> and <code>Cache-Control</code> information.
+    A cached image is served without touching the network while it is fresh,
+    and is revalidated with a conditional request once it has gone stale.
+    Connections are kept alive and reused for each host (per thread).</p>
+    
+    <p>In {@link offline offline} mode, only the cache is used.</p>
+    
+    <p>Once the cached images take up more than {@link max_size max_size},
+    the least recently used ones are removed.</p>
+    
+    @ivar directory The directory the cache is stored in
+    @type directory str
+    @ivar max_size The maximum total size of the cached images (in bytes)
+    @type max_size int
+    @ivar offline Whether to serve images only from the cache
+    @type offline bool
+    @ivar timeout The network timeout (in seconds)
+    @type timeout float
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR, offline=False,
+                 timeout=30, max_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.offline = offline
+        self.timeout = timeout
+        self._local = threading.local()
+    
+    # PUBLIC METHODS #
+    
+    def fetch(self, url):
+        """
+        Retrieves an image, from the cache if possible.
+        
+        @param url The image's location
+        @type url str
+        @raises IOError if the image can't be retrieved
+        @return The image data and its MIME type (<code>None</code> if the
+                server did not give one)
+        @returntype tuple of (file-like object, str)
+        """
+        meta = self._load_meta(url)
+        if meta is not None:
+            if self.offline or self._is_fresh(meta):
+                return self._open_cached(url, meta)
+        elif self.offline:
+            raise IOError("Image is not cached: %s" % url)
+        return self._fetch_remote(url, meta)
+    
+    def prefetch(self, urls, workers=4):
+        """
+        Fetches many images into the cache concurrently.
+        
+        @param urls The images' locations
+        @type urls iterable of str
+        @keyword workers The number of threads to fetch with
+        @type workers int
+        @return The errors that occurred, keyed by URL
+        @returntype dict
+        """
+        queue = Queue()
+        urls = sorted(set(urls))
+        for url in urls:
+            queue.put(url)
+        errors = {}
+        if urls and not self.offline:
+            try:
+                self._make_directory()
+            except OSError, e:
+                # Nothing could be cached, so don't bother downloading
+                return dict((url, e) for url in urls)
+        def run():
+            while True:
+                try:
+                    url = queue.get_nowait()
+                except Empty:
+                    return
+                try:
+                    f, content_type = self.fetch(url)
+                    f.close()
+                except (EnvironmentError, httplib.HTTPException,
+                        socket.error), e:
+                    errors[url] = e
+        threads = [threading.Thread(target=run)
+                   for i in xrange(min(workers, len(urls)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+    
+    def prefetch_test(self, test, workers=4):
+        """
+        Fetches every linked image in a test into the cache concurrently.
+        
+        @param test The test to fetch images for
+        @type test {@link model.Test Test}
+        @keyword workers The number of threads to fetch with
+        @type workers int
+        @return The errors that occurred, keyed by URL
+        @returntype dict
+        """
+        urls = []
+        for question in test.questions:
+            for image in question.images:
+                # Image pages have their own images
+                for subimage in getattr(image, 'images', [image]):
+                    if subimage.link:
+                        urls.append(subimage.link)
+        return self.prefetch(urls, workers)
+    
+    # CACHE #
+    
+    def _get_cache_path(self, url, suffix):
+        return os.path.join(self.directory,
+                            sha1(url).hexdigest() + suffix)
+    
+    def _load_meta(self, url):
+        try:
+            f = open(self._get_cache_path(url, '.meta'), 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                meta = json.load(f)
+            except ValueError:
+                return None
+        finally:
+            f.close()
+        if meta.get('url') != url or \
+           not os.path.exists(self._get_cache_path(url, '.data')):
+            return None
+        return meta
+    
+    def _is_fresh(self, meta):
+        if meta.get('no_cache') or meta.get('expires') is None:
+            return False
+        return time.time() < meta['expires']
+    
+    def _open_cached(self, url, meta):
+        data_path = self._get_cache_path(url, '.data')
+        f = open(data_path, 'rb')
+        # Mark as recently used
+        try:
+            os.utime(data_path, None)
+        except OSError:
+            pass
+        return f, meta.get('content_type')
+    
+    def _make_directory(self):
+        try:
+            os.makedirs(self.directory)
+        except OSError, e:
+            # Another thread may have just created it
+            if e.errno != errno.EEXIST or not os.path.isdir(self.directory):
+                raise
+    
+    def _write_atomic(self, path, data):
+        fd, temp_path = mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(temp_path, path)
+        except:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+    
+    def _store(self, url, response, body):
+        """
+        Stores a response in the cache, if it is allowed.
+        
+        The cache is only an optimization, so failing to write it (for
+        example, because the directory is read-only) is silently ignored.
+        
+        @return The new cache metadata, or <code>None</code> if the response
+                can't be cached
+        @returntype dict
+        """
+        cache_control = _parse_cache_control(
+            response.getheader('Cache-Control'))
+        if 'no-store' in cache_control:
+            return None
+        meta = {'url': url,
+                'content_type': response.getheader('Content-Type'),
+                'etag': response.getheader('ETag'),
+                'last_modified': response.getheader('Last-Modified'),
+                'no_cache': 'no-cache' in cache_control,
+                'expires': None,}
+        self._update_expiry(meta, response, cache_control)
+        data_path = self._get_cache_path(url, '.data')
+        try:
+            if not os.path.isdir(self.directory):
+                self._make_directory()
+            # Data first, so that metadata never points at a missing file
+            self._write_atomic(data_path, body)
+            self._write_meta(url, meta)
+        except EnvironmentError:
+            return None
+        self._evict(keep=data_path)
+        return meta
+    
+    def _evict(self, keep=None):
+        """
+        Removes the least recently used images until the cache fits in
+        {@link max_size max_size}.
+        
+        @keyword keep A data file that must not be removed
+        @type keep str
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        entries = []
+        total_size = 0
+        for name in names:
+            if not name.endswith('.data'):
+                continue
+            data_path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(data_path)
+            except OSError:
+                continue
+            total_size += stat.st_size
+            if data_path != keep:
+                entries.append((stat.st_mtime, data_path, stat.st_size))
+        # Least recently used first
+        entries.sort()
+        for mtime, data_path, size in entries:
+            if total_size <= self.max_size:
+                break
+            # Metadata first, so that it never points at a missing file
+            for path in (data_path[:-len('.data')] + '.meta', data_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total_size -= size
+    
+    def _write_meta(self, url, meta):
+        self._write_atomic(self._get_cache_path(url, '.meta'),
+                           json.dumps(meta))
+    
+    @staticmethod
+    def _update_expiry(meta, response, cache_control):
+        now = time.time()
+        max_age = cache_control.get('max-age')
+        if max_age is not None:
+            try:
+                meta['expires'] = now + int(max_age)
+                return
+            except ValueError:
+                pass
+        expires = _parse_http_date(response.getheader('Expires'))
+        if expires is not None:
+            date = _parse_http_date(response.getheader('Date')) or now
+            meta['expires'] = now + (expires - date)
+    
+    # NETWORK #
+    
+    def _get_connection(self, scheme, netloc, fresh=False):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = (scheme, netloc)
+        connection = connections.get(key)
+        if connection is not None and fresh:
+            connection.close()
+            connection = None
+        if connection is None:
+            if scheme == 'https':
+                connection = httplib.HTTPSConnection(netloc,
+                                                     timeout=self.timeout)
+            else:
+                connection = httplib.HTTPConnection(netloc,
+                                                    timeout=self.timeout)
+            connections[key] = connection
+        return connection
+    
+    def _request(self, url, headers):
+        """
+        Sends a GET request over a kept-alive connection.
+        
+        @return The response and its body
+        @returntype tuple
+        """
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        if scheme not in ('http', 'https'):
+            raise IOError("Unsupported URL scheme: %s" % url)
+        if query:
+            path += '?' + query
+        path = path or '/'
+        for attempt in (0, 1):
+            # A kept-alive connection may have been closed by the server;
+            # retry once on a fresh connection
+            connection = self._get_connection(scheme, netloc,
+                                              fresh=(attempt > 0))
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if attempt > 0:
+                    raise
+            else:
+                if response.will_close:
+                    connection.close()
+                return response, body
+    
+    def _fetch_remote(self, url, meta):
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        request_url = url
+        for i in xrange(_MAX_REDIRECTS + 1):
+            response, body = self._request(request_url, headers)
+            location = response.getheader('Location')
+            if response.status in (301, 302, 303, 307) and location:
+                request_url = urljoin(request_url, location)
+                continue
+            break
+        if response.status == 304 and meta is not None:
+            # Not modified: refresh the expiry and use the cached copy
+            cache_control = _parse_cache_control(
+                response.getheader('Cache-Control'))
+            self._update_expiry(meta, response, cache_control)
+            try:
+                self._write_meta(url, meta)
+            except EnvironmentError:
+                # The old expiry is kept, so it will just be checked again
+                pass
+            return self._open_cached(url, meta)
+        if response.status != 200:
+            raise IOError("HTTP error %d fetching %s" % (response.status,
+                                                          url))
+        meta = self._store(url, response, body)
+        if meta is None:
+            return StringIO(body), response.getheader('Content-Type')
+        return self._open_cached(url, meta)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+#   imagerender.py
+#   Educational toolkit
+#
+
+"""Render-ready, pre-scaled image variants"""
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6 and older
+    from model import OrderedDict
+from hashlib import sha1
+import weakref
+
+import pygtk
+pygtk.require('2.0')
+import gtk
+
+import model
+
+__docformat__ = "JavaDoc"
+__all__ = ['compute_size',
+           'RenderCache',]
+
+def compute_size(natural_size, declared_size=None, bounds=None):
+    """
+    Determines the size to render an image at.
+    
+    <p>If only one dimension is declared, the other is scaled in proportion.
+    If <code>bounds</code> is given, the result is then shrunk (never grown)
+    to fit inside it, keeping the aspect ratio.</p>
+    
+    @param natural_size The width and height of the image data
+    @type natural_size tuple of int
+    @keyword declared_size The {@link model.Image.size size} declared for the
+                           image
+    @type declared_size tuple of int
+    @keyword bounds The maximum width and height
+    @type bounds tuple of int
+    @return The width and height to render at
+    @returntype tuple of int
+    """
+    natural_width, natural_height = natural_size
+    width, height = declared_size or (None, None)
+    if width is None and height is None:
+        width, height = natural_width, natural_height
+    elif width is None:
+        width = max(1, int(round(natural_width * height /
+                                 float(natural_height))))
+    elif height is None:
+        height = max(1, int(round(natural_height * width /
+                                  float(natural_width))))
+    if bounds is not None:
+        scale = min(1.0, bounds[0] / float(width), bounds[1] / float(height))
+        width = max(1, int(round(width * scale)))
+        height = max(1, int(round(height * scale)))
+    return (width, height)
+
+class RenderCache(object):
+    """
+    Decodes images once and keeps scaled variants of them.
+    
+    <p>Variants are keyed by the SHA-1 of the image data and the target size,
+    so the same picture used by several questions (or tests) shares its
+    variants, and switching between question pages neither decodes nor
+    scales anything again.  The least recently used variants are dropped
+    once there are more than {@link max_variants max_variants}.</p>
+    
+    @ivar max_variants The maximum number of pixbufs to keep
+    @type max_variants int
+    @ivar thumbnail_size The bounding box for
+                         {@link get_thumbnail thumbnails}
+    @type thumbnail_size tuple of int
+    """
+    def __init__(self, max_variants=128, thumbnail_size=(96, 96)):
+        self.max_variants = max_variants
+        self.thumbnail_size = thumbnail_size
+        self._variants = OrderedDict()
+        self._digests = weakref.WeakKeyDictionary()
+    
+    def get_pixbuf(self, image, bounds=None):
+        """
+        Retrieves an image scaled to its declared size.
+        
+        @param image The image to render
+        @type image {@link model.Image Image}
+        @keyword bounds The maximum width and height to render at
+        @type bounds tuple of int
+        @return The scaled image
+        @returntype <code>gtk.gdk.Pixbuf</code>
+        """
+        digest = self._get_digest(image)
+        original = self._get_original(image, digest)
+        size = compute_size((original.get_width(), original.get_height()),
+                            image.size, bounds)
+        return self._get_variant(digest, original, size)
+    
+    def get_thumbnail(self, image):
+        """
+        Retrieves a thumbnail of an image.
+        
+        @param image The image to render
+        @type image {@link model.Image Image}
+        @return The image, shrunk to fit in
+                {@link thumbnail_size thumbnail_size}
+        @returntype <code>gtk.gdk.Pixbuf</code>
+        """
+        digest = self._get_digest(image)
+        original = self._get_original(image, digest)
+        size = compute_size((original.get_width(), original.get_height()),
+                            bounds=self.thumbnail_size)
+        return self._get_variant(digest, original, size)
+    
+    def get_page_thumbnails(self, page):
+        """
+        Retrieves thumbnails for every image on an image page.
+        
+        @param page The page to render
+        @type page {@link model.ImagePage ImagePage}
+        @returntype list of <code>gtk.gdk.Pixbuf</code>
+        """
+        return [self.get_thumbnail(image) for image in page.images]
+    
+    def prepare_test(self, test, bounds=None):
+        """
+        Renders every image of a test ahead of time.
+        
+        Single images are scaled to their declared size and images on image
+        pages are thumbnailed.
+        
+        @param test The test to render images for
+        @type test {@link model.Test Test}
+        @keyword bounds The maximum width and height to render at
+        @type bounds tuple of int
+        """
+        for question in test.questions:
+            for image in question.images:
+                if isinstance(image, model.ImagePage):
+                    self.get_page_thumbnails(image)
+                else:
+                    self.get_pixbuf(image, bounds)
+    
+    def clear(self):
+        """Drops every cached variant."""
+        self._variants.clear()
+    
+    def _get_digest(self, image):
+        try:
+            return self._digests[image]
+        except KeyError:
+            pass
+        source = image.get_source()
+        try:
+            data = source.read()
+        finally:
+            source.close()
+        digest = self._digests[image] = sha1(data).hexdigest()
+        # Decode while the data is at hand
+        if (digest, None) not in self._variants:
+            self._remember((digest, None), self._decode(data))
+        return digest
+    
+    def _get_original(self, image, digest):
+        key = (digest, None)
+        original = self._lookup(key)
+        if original is None:
+            source = image.get_source()
+            try:
+                original = self._decode(source.read())
+            finally:
+                source.close()
+            self._remember(key, original)
+        return original
+    
+    def _get_variant(self, digest, original, size):
+        if size == (original.get_width(), original.get_height()):
+            return original
+        key = (digest, size)
+        variant = self._lookup(key)
+        if variant is None:
+            variant = original.scale_simple(size[0], size[1],
+                                            gtk.gdk.INTERP_BILINEAR)
+            self._remember(key, variant)
+        return variant
+    
+    @staticmethod
+    def _decode(data):
+        loader = gtk.gdk.PixbufLoader()
+        try:
+            loader.write(data)
+        finally:
+            loader.close()
+        return loader.get_pixbuf()
+    
+    def _lookup(self, key):
+        try:
+            variant = self._variants.pop(key)
+        except KeyError:
+            return None
+        # Mark as most recently used
+        self._variants[key] = variant
+        return variant
+    
+    def _remember(self, key, variant):
+        self._variants[key] = variant
+        while len(self._variants) > self.max_variants:
+            self._variants.popitem(last=False)
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+#
+#   itemstats.py
+#   Educational toolkit
+#
+
+"""Running statistics about how questions are answered"""
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import math
+import os
+from tempfile import mkstemp
+
+__docformat__ = "JavaDoc"
+__all__ = ['ItemStatistics',
+           'StatisticsEngine',]
+
+_SNAPSHOT_VERSION = 1
+
+class ItemStatistics(object):
+    """
+    Running statistics for a single question.
+    
+    <p>The statistics are updated one answer at a time in constant memory;
+    the time statistics use Welford's method, so they stay accurate over
+    long runs.</p>
+    
+    @ivar count The number of answers seen
+    @type count int
+    @ivar mean_time The mean time (in seconds) taken to answer
+    @type mean_time float
+    @ivar hint_count The number of answers given after viewing the hint
+    @type hint_count int
+    @ivar graded_count The number of answers known to be right or wrong
+    @type graded_count int
+    @ivar correct_count The number of correct answers
+    @type correct_count int
+    """
+    __slots__ = ('count', 'mean_time', '_time_m2', 'hint_count',
+                 'graded_count', 'correct_count')
+    def __init__(self):
+        self.count = 0
+        self.mean_time = 0.0
+        self._time_m2 = 0.0
+        self.hint_count = 0
+        self.graded_count = 0
+        self.correct_count = 0
+    
+    def __repr__(self):
+        return ("ItemStatistics(count=%d, mean_time=%r, hint_count=%d, "
+                "graded_count=%d, correct_count=%d)" %
+                (self.count, self.mean_time, self.hint_count,
+                 self.graded_count, self.correct_count))
+    
+    def add(self, time_taken, hint_used=False, correct=None):
+        """
+        Records an answer.
+        
+        @param time_taken The time (in seconds) taken to answer
+        @type time_taken float
+        @keyword hint_used Whether the student viewed the hint
+        @type hint_used bool
+        @keyword correct Whether the answer was correct, or <code>None</code>
+                         if it is not known
+        @type correct bool
+        """
+        self.count += 1
+        delta = time_taken - self.mean_time
+        self.mean_time += delta / self.count
+        self._time_m2 += delta * (time_taken - self.mean_time)
+        if hint_used:
+            self.hint_count += 1
+        if correct is not None:
+            self.graded_count += 1
+            if correct:
+                self.correct_count += 1
+    
+    def add_grade(self, correct):
+        """
+        Records the grading of an answer that was added while pending.
+        
+        Only the grading counts change; the answer itself was already
+        counted by {@link add add}.
+        
+        @param correct Whether the answer was correct
+        @type correct bool
+        """
+        self.graded_count += 1
+        if correct:
+            self.correct_count += 1
+    
+    def merge(self, other):
+        """
+        Adds the answers recorded by another set of statistics.
+        
+        @param other The statistics to merge in
+        @type other {@link ItemStatistics ItemStatistics}
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean_time - self.mean_time
+        self._time_m2 += (other._time_m2 +
+                          delta * delta * self.count * other.count / count)
+        self.mean_time += delta * other.count / count
+        self.count = count
+        self.hint_count += other.hint_count
+        self.graded_count += other.graded_count
+        self.correct_count += other.correct_count
+    
+    @property
+    def time_variance(self):
+        """The sample variance of the time taken, or <code>None</code> with
+        fewer than two answers."""
+        if self.count < 2:
+            return None
+        return self._time_m2 / (self.count - 1)
+    
+    @property
+    def time_stddev(self):
+        """The sample standard deviation of the time taken."""
+        variance = self.time_variance
+        if variance is None:
+            return None
+        return math.sqrt(variance)
+    
+    @property
+    def hint_rate(self):
+        """The fraction of answers given after viewing the hint."""
+        if self.count == 0:
+            return None
+        return self.hint_count / float(self.count)
+    
+    @property
+    def correct_rate(self):
+        """The fraction of graded answers that were correct."""
+        if self.graded_count == 0:
+            return None
+        return self.correct_count / float(self.graded_count)
+    
+    def _to_list(self):
+        return [self.count, self.mean_time, self._time_m2, self.hint_count,
+                self.graded_count, self.correct_count]
+    
+    @classmethod
+    def _from_list(cls, values):
+        stats = cls()
+        (stats.count, stats.mean_time, stats._time_m2, stats.hint_count,
+         stats.graded_count, stats.correct_count) = values
+        return stats
+
+class StatisticsEngine(object):
+    """
+    Maintains {@link ItemStatistics statistics} for many questions as answers
+    arrive.
+    
+    <p>Answers are folded in as they are received, so the full answer
+    history never needs to be kept or re-read.  Snapshots of the statistics
+    can be {@link save saved} and {@link load loaded} later to carry on, and
+    the statistics can be {@link apply applied} back to tests.</p>
+    
+    @cvar difficulty_levels The difficulty given to a question by
+                            {@link apply apply}, as (minimum correct rate,
+                            difficulty) pairs, highest rate first
+    @type difficulty_levels tuple
+    @ivar key The answer key used to tell whether answers are correct
+    @type key {@link model.AnswerKey AnswerKey}
+    """
+    difficulty_levels = ((0.75, u"Easy"),
+                         (0.4, u"Medium"),
+                         (0.0, u"Hard"),)
+    
+    def __init__(self, key=None):
+        self.key = key
+        self._items = {}
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def __iter__(self):
+        return iter(self._items)
+    
+    def __contains__(self, qid):
+        return qid in self._items
+    
+    def __getitem__(self, qid):
+        return self._items[qid]
+    
+    # RECORDING #
+    
+    def add_answer(self, answer, correct=None):
+        """
+        Records a single answer.
+        
+        @param answer The answer to record
+        @type answer {@link model.Answer Answer}
+        @keyword correct Whether the answer was correct.  If not given, the
+                         {@link key key} (if any) is checked.
+        @type correct bool
+        """
+        if correct is None and self.key is not None:
+            correct = self.key.check(answer)
+        try:
+            stats = self._items[answer.id]
+        except KeyError:
+            stats = self._items[answer.id] = ItemStatistics()
+        stats.add(answer.time_taken, answer.hint_used, correct)
+    
+    def add_answers(self, answers, results=None):
+        """
+        Records a student's answers.
+        
+        @param answers The answers to record
+        @type answers list of {@link model.Answer Answers}
+        @keyword results The grading of the answers.  If not given, the
+                         {@link key key} (if any) is checked.
+        @type results {@link model.Results Results}
+        """
+        if results is None:
+            for answer in answers:
+                self.add_answer(answer)
+            return
+        correct = set(results.correct or ())
+        incorrect = set(results.incorrect or ())
+        for answer in answers:
+            if answer.id in correct:
+                self.add_answer(answer, True)
+            elif answer.id in incorrect:
+                self.add_answer(answer, False)
+            else:
+                # Still pending (see record_grade); don't let the key guess
+                stats = self._items.get(answer.id)
+                if stats is None:
+                    stats = self._items[answer.id] = ItemStatistics()
+                stats.add(answer.time_taken, answer.hint_used)
+    
+    def record_grade(self, qid, correct):
+        """
+        Records the grading of an answer that was pending when it was
+        {@link add_answers added}.
+        
+        <p>Answers that are pending in the results given to
+        {@link add_answers add_answers} count towards the time and hint
+        statistics but not the correct rate.  Whatever grades pending
+        answers (such as {@link model.Results.grade Results.grade}) should
+        call this once the answer is graded, so only the graded and correct
+        counts are updated and the answer is not counted twice.</p>
+        
+        @param qid The question ID of the answer
+        @type qid str
+        @param correct Whether the answer was correct
+        @type correct bool
+        @raises KeyError if no answers to the question have been recorded
+        """
+        self._items[qid].add_grade(correct)
+    
+    def merge(self, other):
+        """
+        Adds the answers recorded by another engine.
+        
+        @param other The engine to merge in
+        @type other {@link StatisticsEngine StatisticsEngine}
+        """
+        for qid, other_stats in other._items.iteritems():
+            try:
+                stats = self._items[qid]
+            except KeyError:
+                stats = self._items[qid] = ItemStatistics()
+            stats.merge(other_stats)
+    
+    # APPLYING #
+    
+    def get_difficulty(self, qid):
+        """
+        Determines a question's difficulty from how often it is answered
+        correctly.
+        
+        @param qid The question's ID
+        @type qid str
+        @return The difficulty, or <code>None</code> if no answers to the
+                question have been graded
+        @returntype unicode
+        """
+        stats = self._items.get(qid)
+        if stats is None or stats.correct_rate is None:
+            return None
+        for minimum, difficulty in self.difficulty_levels:
+            if stats.correct_rate >= minimum:
+                return difficulty
+        return self.difficulty_levels[-1][1]
+    
+    def apply(self, test, min_count=1):
+        """
+        Writes the statistics into a test's questions.
+        
+        Each question's <code>average_time</code> is set to the mean time
+        taken, and its <code>difficulty</code> is set by
+        {@link get_difficulty get_difficulty}.  Questions with fewer than
+        <code>min_count</code> answers are left alone.
+        
+        @param test The test to update
+        @type test {@link model.Test Test}
+        @keyword min_count The number of answers needed before a question is
+                           updated
+        @type min_count int
+        @return The number of questions updated
+        @returntype int
+        """
+        updated = 0
+        for question in test.questions:
+            stats = self._items.get(question.id)
+            if stats is None or stats.count < max(min_count, 1):
+                continue
+            question.average_time = stats.mean_time
+            difficulty = self.get_difficulty(question.id)
+            if difficulty is not None:
+                question.difficulty = difficulty
+            updated += 1
+        return updated
+    
+    # SNAPSHOTS #
+    
+    def save(self, path):
+        """
+        Saves a snapshot of the statistics.
+        
+        The file is replaced atomically, so a crash never leaves a partial
+        snapshot behind.
+        
+        @param path The file to save to
+        @type path str
+        """
+        snapshot = {'version': _SNAPSHOT_VERSION,
+                    'items': dict((qid, stats._to_list())
+                                  for qid, stats in self._items.iteritems()),}
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = mkstemp(suffix='.tmp', dir=directory)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                json.dump(snapshot, f)
+            finally:
+                f.close()
+            os.rename(temp_path, path)
+        except:
+            # Don't leave the partial snapshot behind
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+    
+    @classmethod
+    def load(cls, path, key=None):
+        """
+        Loads a snapshot of statistics.
+        
+        @param path The file to load from
+        @type path str
+        @keyword key The answer key to grade new answers with
+        @type key {@link model.AnswerKey AnswerKey}
+        @raises ValueError if the file is not a snapshot
+        @return The engine, ready to record more answers
+        @returntype {@link StatisticsEngine StatisticsEngine}
+        """
+        f = open(path, 'rb')
+        try:
+            snapshot = json.load(f)
+        finally:
+            f.close()
+        if not isinstance(snapshot, dict) or \
+           snapshot.get('version') != _SNAPSHOT_VERSION:
+            raise ValueError("Unsupported statistics snapshot: %s" % path)
+        engine = cls(key)
+        for qid, values in snapshot['items'].iteritems():
+            engine._items[qid] = ItemStatistics._from_list(values)
+        return engine
@@ -6,9 +6,22 @@
 
 """Model objects"""
 
-from shutil import copyfileobj
-from tempfile import TemporaryFile
-from urllib2 import urlopen
+import atexit
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+from cStringIO import StringIO
+from hashlib import sha1
+import mmap
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+import threading
+import unicodedata
+import weakref
+
+import imagefetch
 
 __author__ = "Ross Light"
 __date__ = "April 2, 2008"
@@ -16,6 +29,7 @@ __docformat__ = "JavaDoc"
 __all__ = ['get_sugar_name',
            'Blank',
            'QuestionText',
+           'ImageStore',
            'Image',
            'ImagePage',
            'Test',
@@ -27,7 +41,74 @@ __all__ = ['get_sugar_name',
            'FlashCard',
            'AnswerList',
            'Answer',
-           'Results',]
+           'AnswerKey',
+           'Results',
+           'QuestionIndex',
+           'BitsetResults',]
+
+if OrderedDict is None:
+    class OrderedDict(dict):
+        """
+        A minimal stand-in for <code>collections.OrderedDict</code>, which
+        is new in Python 2.7.
+        
+        Only what the least recently used caches in this package need is
+        supported: keys are kept in insertion order in a list, so removing
+        a key takes time in proportion to the size of the dictionary.
+        """
+        def __init__(self):
+            dict.__init__(self)
+            self._keys = []
+        
+        def __setitem__(self, key, value):
+            if key not in self:
+                self._keys.append(key)
+            dict.__setitem__(self, key, value)
+        
+        def __delitem__(self, key):
+            dict.__delitem__(self, key)
+            self._keys.remove(key)
+        
+        def __iter__(self):
+            return iter(self._keys)
+        
+        def pop(self, key, *default):
+            if key in self:
+                self._keys.remove(key)
+            return dict.pop(self, key, *default)
+        
+        def popitem(self, last=True):
+            if not self._keys:
+                raise KeyError("dictionary is empty")
+            if last:
+                key = self._keys[-1]
+            else:
+                key = self._keys[0]
+            return key, self.pop(key)
+        
+        def clear(self):
+            dict.clear(self)
+            del self._keys[:]
+        
+        def keys(self):
+            return list(self._keys)
+        
+        def iterkeys(self):
+            return iter(self._keys)
+        
+        def itervalues(self):
+            for key in self._keys:
+                yield self[key]
+        
+        def iteritems(self):
+            for key in self._keys:
+                yield key, self[key]
+        
+        def values(self):
+            return list(self.itervalues())
+        
+        def items(self):
+            return list(self.iteritems())
 
 def get_sugar_name():
     """
@@ -46,6 +127,7 @@ class Blank(object):
     @ivar length The length of the blank
     @type length int
     """
+    __slots__ = ('length',)
     def __init__(self, length=10):
         self.length = length
     
@@ -65,6 +147,12 @@ class QuestionText(object):
     <code>QuestionText</code> objects can be used sequence-like to access its
     children.
     
+    <p>The rendered text and its {@link get_layout layout} are cached until
+    the text is changed through its methods or by assigning
+    {@link content content}.  Call {@link invalidate invalidate} after
+    changing {@link content content} in place or resizing a
+    {@link Blank Blank}.</p>
+    
     @ivar content The content of the tree
     @type content list
     """
@@ -74,6 +162,13 @@ class QuestionText(object):
         else:
             self.content = list(content)
     
+    def _get_content(self):
+        return self._content
+    def _set_content(self, value):
+        self._content = value
+        self.invalidate()
+    content = property(_get_content, _set_content)
+    
     # STRING REPRESENTATION #
     
     def __repr__(self):
@@ -83,46 +178,278 @@ class QuestionText(object):
         return unicode(self).encode()
     
     def __unicode__(self):
-        return u''.join(unicode(child) for child in self.content)
+        if self._rendered is None:
+            self._render()
+        return self._rendered
+    
+    def _render(self):
+        runs = []
+        layout = []
+        blanks = []
+        offset = 0
+        for child in self._content:
+            if isinstance(child, Blank):
+                if runs:
+                    layout.append(u''.join(runs))
+                    del runs[:]
+                layout.append(child)
+                blanks.append((offset, offset + child.length))
+                offset += child.length
+            else:
+                child = unicode(child)
+                runs.append(child)
+                offset += len(child)
+        if runs:
+            layout.append(u''.join(runs))
+        self._layout = tuple(layout)
+        self._blank_spans = tuple(blanks)
+        self._rendered = u''.join(unicode(segment) for segment in layout)
     
     # PUBLIC METHODS #
     
     def append(self, item):
-        self.content.append(item)
+        self._content.append(item)
+        self.invalidate()
     
     def insert(self, index, item):
-        self.content.insert(index, item)
+        self._content.insert(index, item)
+        self.invalidate()
     
     def remove(self, item):
-        self.content.remove(item)
+        self._content.remove(item)
+        self.invalidate()
+    
+    def invalidate(self):
+        """Discards the cached rendering."""
+        self._rendered = None
+        self._layout = None
+        self._blank_spans = None
+    
+    def get_layout(self):
+        """
+        Retrieves the text split into segments.
+        
+        Neighbouring text children are merged into a single run, so the
+        segments alternate between text and {@link Blank blanks}.
+        
+        @returntype tuple of unicode and {@link Blank Blank}
+        """
+        if self._layout is None:
+            self._render()
+        return self._layout
+    
+    def get_blank_spans(self):
+        """
+        Retrieves where the blanks are in the rendered text.
+        
+        @return A (start, end) offset pair for each blank, in order
+        @returntype tuple of tuple
+        """
+        if self._blank_spans is None:
+            self._render()
+        return self._blank_spans
     
     # SEQUENCE ACCESS #
     
     def __nonzero__(self):
-        return len(self.content) != 0
+        return len(self._content) != 0
     
     def __iter__(self):
-        return iter(self.content)
+        return iter(self._content)
     
     def __len__(self):
-        return len(self.content)
+        return len(self._content)
     
     def __getitem__(self, item):
-        return self.content[item]
+        return self._content[item]
     
     def __setitem__(self, item, value):
-        self.content[item] = value
+        self._content[item] = value
+        self.invalidate()
     
     def __delitem__(self, item):
-        del self.content[item]
+        del self._content[item]
+        self.invalidate()
     
     def __contains__(self, item):
-        return item in self.content
+        return item in self._content
+
+class _StoredImage(object):
+    """An entry in an {@link ImageStore ImageStore}."""
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.path = None
+        self.refs = 0
+
+class ImageStore(object):
+    """
+    Content-addressed storage for image data.
+    
+    <p>Data is keyed by its SHA-1, so identical images (such as a logo
+    embedded in many tests) are only stored once.  Entries are reference
+    counted and removed when the last image using them lets go.  Once the
+    data held in memory exceeds {@link memory_limit memory_limit}, the least
+    recently used entries are moved to files and read back with memory
+    mapping; no file descriptor is kept open for them.</p>
+    
+    @ivar memory_limit The maximum number of bytes to keep in memory
+    @type memory_limit int
+    @ivar memory_size The number of bytes currently held in memory
+    @type memory_size int
+    """
+    def __init__(self, memory_limit=8 * 1024 * 1024):
+        self.memory_limit = memory_limit
+        self.memory_size = 0
+        self._entries = OrderedDict()
+        self._directory = None
+        self._lock = threading.Lock()
+    
+    def add(self, data):
+        """
+        Adds a reference to image data, storing the data if it is new.
+        
+        @param data The image data
+        @type data str
+        @return The key of the data
+        @returntype str
+        """
+        digest = sha1(data).hexdigest()
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(digest)
+            if entry is None:
+                entry = self._entries[digest] = _StoredImage(data)
+                self.memory_size += entry.size
+                self._spill()
+            entry.refs += 1
+        finally:
+            self._lock.release()
+        return digest
+    
+    def release(self, digest):
+        """
+        Removes a reference to image data, deleting the data if it was the
+        last reference.
+        
+        @param digest The key of the data
+        @type digest str
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries[digest]
+            entry.refs -= 1
+            if entry.refs > 0:
+                return
+            del self._entries[digest]
+            if entry.path is None:
+                self.memory_size -= entry.size
+            else:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        finally:
+            self._lock.release()
+    
+    def open(self, digest):
+        """
+        Opens image data for reading.
+        
+        @param digest The key of the data
+        @type digest str
+        @raises KeyError if there is no data with the given key
+        @return The data
+        @returntype file-like object
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(digest)
+            # Mark as most recently used
+            self._entries[digest] = entry
+            if entry.path is None:
+                return StringIO(entry.data)
+            f = open(entry.path, 'rb')
+            try:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                f.close()
+            # StringIO reads straight from the mapping without copying it
+            return StringIO(mapping)
+        finally:
+            self._lock.release()
+    
+    def __contains__(self, digest):
+        return digest in self._entries
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _spill(self):
+        """Moves data to disk until the memory limit is met."""
+        if self.memory_size <= self.memory_limit:
+            return
+        for digest, entry in self._entries.iteritems():
+            if self.memory_size <= self.memory_limit:
+                break
+            # Empty files can't be mapped, so keep empty data in memory
+            if entry.path is not None or entry.size == 0:
+                continue
+            if self._directory is None:
+                self._directory = mkdtemp(prefix='edtoolkit-images-')
+                atexit.register(rmtree, self._directory, True)
+            path = os.path.join(self._directory, digest)
+            f = open(path, 'wb')
+            try:
+                f.write(entry.data)
+            finally:
+                f.close()
+            entry.path = path
+            entry.data = None
+            self.memory_size -= entry.size
+
+# Weak references to images that hold store references, keyed by id().
+# They must be kept outside the images: when a garbage cycle is collected,
+# the callbacks of weak references inside the cycle are not called.
+_image_refs = {}
+
+def _track_image(image, store, digest):
+    """
+    Releases an image's reference into a store once the image is gone.
+    
+    Unlike <code>__del__</code>, this works for images caught in reference
+    cycles.
+    
+    @return The key of the tracking reference, for
+            {@link _untrack_image _untrack_image}
+    @returntype int
+    """
+    def release(ref, refs=_image_refs):
+        try:
+            del refs[id(ref)]
+            store.release(digest)
+        except Exception:
+            # The store may already be gone at interpreter shutdown
+            pass
+    ref = weakref.ref(image, release)
+    _image_refs[id(ref)] = ref
+    return id(ref)
+
+def _untrack_image(key):
+    """Stops tracking an image, without releasing its store reference."""
+    _image_refs.pop(key, None)
 
 class Image(object):
     """
     An image for a question.
     
+    Image data is kept in a shared {@link ImageStore ImageStore}, given by
+    the {@link store store} attribute.
+    
+    @cvar store The store that holds image data
+    @type store {@link ImageStore ImageStore}
+    @cvar fetcher The fetcher used to retrieve linked images
+    @type fetcher {@link imagefetch.ImageFetcher ImageFetcher}
     @ivar mime_type The suggested MIME type of the image
     @type str
     @ivar title The human-readable description of the image
@@ -132,15 +459,23 @@ class Image(object):
     @ivar link A URL to the image.  May be <code>None</code> if data was
                given (via {@link set_data set_data}).
     @type link str
-    @ivar size The width and height of the image (in pixels)
+    @ivar size The width and height of the image (in pixels).  Either may be
+               <code>None</code>, in which case it is scaled in proportion
+               to the other.
     @type size tuple of int
     """
+    store = ImageStore()
+    fetcher = imagefetch.ImageFetcher()
+    
     def __init__(self, mime_type, title=None, size=None, position='left'):
         assert position in ('left', 'center', 'right')
         self.mime_type = mime_type
         self.title = title
         self.link = None
-        self._data_file = None
+        self._digest = None
+        self._digest_ref = None
+        self._data_loader = None
+        self._cache_data = True
         self.size = size
         self.position = position
     
@@ -150,21 +485,28 @@ class Image(object):
         
         If this image is fetched from HTTP, then the
         {@link mime_type MIME type} will be updated to reflect the server's
-        reported MIME type.
+        reported MIME type.  Linked images are retrieved through
+        {@link fetcher fetcher}, so they are only downloaded again when the
+        server says that they have changed.
         
         @raises ValueError if the image does not yet have a source
+        @raises IOError if a linked image can't be retrieved
         @return The image's source
         @returntype file-like object
         """
         if self.link is not None:
-            f = urlopen(self.link)
-            new_type = f.headers.get('Content-Type', self.mime_type)
-            new_type = new_type.split(';')[0]
-            self.mime_type = new_type
+            f, new_type = self.fetcher.fetch(self.link)
+            if new_type is not None:
+                self.mime_type = new_type.split(';')[0]
             return f
-        elif self._data_file is not None:
-            self._data_file.seek(0)
-            return self._data_file
+        elif self._digest is not None:
+            return self.store.open(self._digest)
+        elif self._data_loader is not None:
+            data = self._data_loader()
+            if self._cache_data:
+                self._set_digest(self.store.add(data))
+                self._data_loader = None
+            return StringIO(data)
         else:
             raise ValueError("This image has not been given a source")
     
@@ -184,15 +526,61 @@ class Image(object):
         @param raw_data The data source
         @type raw_data str or file-link object
         """
-        if self._data_file is None:
-            self._data_file = TemporaryFile()
-        self._data_file.seek(0)
-        self._data_file.truncate()
-        if isinstance(raw_data, basestring):
-            self._data_file.write(raw_data)
-        else:
-            copyfileobj(raw_data, self._data_file)
-        self._data_file.flush()
+        if not isinstance(raw_data, basestring):
+            raw_data = raw_data.read()
+        self._data_loader = None
+        self._set_digest(self.store.add(raw_data))
+    
+    def set_data_loader(self, loader, cache=True):
+        """
+        Sets the image's source to binary data that is produced on demand.
+        
+        The loader is not called until {@link get_source get_source} is first
+        called, so images that are never displayed are never decoded.
+        
+        @param loader A callable that takes no arguments and returns the
+                      image's binary data
+        @type loader callable
+        @keyword cache Whether to keep the data after the first load instead
+                       of calling the loader every time
+        @type cache bool
+        """
+        self._set_digest(None)
+        self._data_loader = loader
+        self._cache_data = cache
+    
+    def _set_digest(self, digest):
+        """Replaces the image's reference into the store."""
+        old_digest = getattr(self, '_digest', None)
+        old_ref = getattr(self, '_digest_ref', None)
+        self._digest = digest
+        self._digest_ref = None
+        if old_ref is not None:
+            _untrack_image(old_ref)
+        if digest is not None:
+            self._digest_ref = _track_image(self, self.store, digest)
+        if old_digest is not None:
+            self.store.release(old_digest)
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._digest is not None:
+            # Store the data itself, not a reference into this process's
+            # store
+            f = self.store.open(self._digest)
+            state['_data'] = f.read()
+            f.close()
+            del state['_digest']
+        state.pop('_digest_ref', None)
+        return state
+    
+    def __setstate__(self, state):
+        data = state.pop('_data', None)
+        self.__dict__.update(state)
+        self._digest = None
+        self._digest_ref = None
+        if data is not None:
+            self._set_digest(self.store.add(data))
     
     def __repr__(self):
         return "model.Image(%r, %r, %r, %r)" % (self.mime_type, self.title,
@@ -273,6 +661,8 @@ class Question(object):
     @ivar hint A hint that the student can view.
     @type hint unicode
     """
+    __slots__ = ('id', 'credits', 'images', 'text', 'difficulty',
+                 'average_time', 'stipulated_time', 'advice', 'hint')
     def __init__(self, qid, text, credits, difficulty=u"Easy"):
         self.id = qid
         self.credits = credits
@@ -301,6 +691,7 @@ class Question(object):
 
 class TrueFalseQuestion(Question):
     """A simple true/false question."""
+    __slots__ = ()
 
 class MultipleChoiceQuestion(Question):
     """
@@ -309,6 +700,7 @@ class MultipleChoiceQuestion(Question):
     @ivar choices A list of (choice_name, choice_text) tuples
     @type choices list of tuple
     """
+    __slots__ = ('choices',)
     def __init__(self, qid, text, choices, *args, **kw):
         super(MultipleChoiceQuestion, self).__init__(qid, text, *args, **kw)
         self.choices = choices
@@ -320,6 +712,7 @@ class ShortAnswerQuestion(Question):
     @ivar expected_length The expected string length of the answer
     @type expected_length int
     """
+    __slots__ = ('expected_length',)
     def __init__(self, qid, text, expected_length, *args, **kw):
         super(ShortAnswerQuestion, self).__init__(qid, text, *args, **kw)
         self.expected_length = expected_length
@@ -336,6 +729,7 @@ class MatchingQuestion(Question):
     @ivar answers The answer phrases to match to
     @type answers list of unicode
     """
+    __slots__ = ('keys', 'answers')
     def __init__(self, qid, text, keys, answers, *args, **kw):
         super(MatchingQuestion, self).__init__(qid, text, *args, **kw)
         self.keys = list(keys)
@@ -368,6 +762,7 @@ class FlashCard(Question):
     @ivar back_text The content of the "back" of the card
     @type back_text unicode
     """
+    __slots__ = ('back_text',)
     def __init__(self, qid, text, back_text, *args, **kw):
         super(FlashCard, self).__init__(qid, text, *args, **kw)
         self.back_text = back_text
@@ -389,6 +784,7 @@ class Answer(object):
     @ivar hint_used Whether the student viewed the hint
     @type hint_used bool
     """
+    __slots__ = ('id', 'answer', 'time_taken', 'hint_used')
     def __init__(self, qid, answer, time_taken, hint_used=False):
         assert time_taken > 0
         self.id = qid
@@ -400,6 +796,13 @@ class AnswerList(object):
     """
     A list of {@link Answer answers}.
     
+    <p>The list keeps an index of its answers by question ID, so
+    {@link get_answer get_answer} and <code>in</code> take constant time.
+    Answers added with {@link append append}, {@link extend extend} or
+    directly to the end of {@link answers answers} are indexed on the next
+    lookup; call {@link reindex reindex} after changing
+    {@link answers answers} in any other way.</p>
+    
     @ivar answers All the answers contained by the list
     @type answers list of {@link Answer Answer objects}
     @ivar student_name The name of the student answering
@@ -409,40 +812,288 @@ class AnswerList(object):
         self.answers = list(answers) if answers is not None else []
         self.student_name = unicode(name) if name is not None else None
     
+    def _get_answers(self):
+        return self._answers
+    def _set_answers(self, value):
+        self._answers = value
+        self.reindex()
+    answers = property(_get_answers, _set_answers)
+    
     # Operator overloading
     # We want to actually be able to use this as a list
     
     def __len__(self):
-        return len(self.answers)
+        return len(self._answers)
     
     def __iter__(self):
-        return iter(self.answers)
+        return iter(self._answers)
     
     def __getitem__(self, item):
-        return self.answers[item] # note that this handles slices, too
+        if isinstance(item, slice):
+            return AnswerList(self._answers[item], self.student_name)
+        return self._answers[item]
     
     def __contains__(self, item):
         if isinstance(item, basestring):
             # Searching for answer ID
-            return bool(self.get_answer(item) is not None)
+            self._update_index()
+            return item in self._index
         else:
-            return item in self.answers
+            return item in self._answers
+    
+    # PUBLIC METHODS #
+    
+    def append(self, answer):
+        """
+        Adds an answer to the end of the list.
+        
+        @param answer The answer to add
+        @type answer {@link Answer Answer}
+        """
+        self._answers.append(answer)
+    
+    def extend(self, answers):
+        """
+        Adds several answers to the end of the list.
+        
+        @param answers The answers to add
+        @type answers iterable of {@link Answer Answer objects}
+        """
+        self._answers.extend(answers)
     
     def get_answer(self, qid):
         """
         Finds the answer with a given ID.
         
+        If there are several answers with the ID, the first one is returned.
+        
         @param qid The answer's ID
         @type qid str
         @raises KeyError if there is no answer present with the given ID
         @return The answer with the requested ID
         @returntype {@link Answer Answer}
         """
-        for answer in self:
-            if answer.id == qid:
-                return answer
-        else:
-            raise KeyError(qid)
+        self._update_index()
+        answer = self._answers[self._index[qid]]
+        if answer.id != qid:
+            # The list was changed behind our back
+            self.reindex()
+            answer = self._answers[self._index[qid]]
+        return answer
+    
+    def get_duplicate_ids(self):
+        """
+        Finds the question IDs that have more than one answer.
+        
+        @returntype set of str
+        """
+        self._update_index()
+        return set(self._duplicate_ids)
+    
+    def reindex(self):
+        """Rebuilds the question ID index from scratch."""
+        self._index = {}
+        self._duplicate_ids = set()
+        self._indexed_count = 0
+        self._update_index()
+    
+    def _update_index(self):
+        """Indexes any answers added to the end of the list."""
+        answers = self._answers
+        if self._indexed_count > len(answers):
+            self.reindex()
+            return
+        index = self._index
+        for i in xrange(self._indexed_count, len(answers)):
+            qid = answers[i].id
+            if qid in index:
+                self._duplicate_ids.add(qid)
+            else:
+                index[qid] = i
+        self._indexed_count = len(answers)
+
+def _normalize_text(text):
+    """Normalizes Unicode composition and collapses whitespace."""
+    return u' '.join(unicodedata.normalize('NFC', unicode(text)).split())
+
+def _normalize_folded(text):
+    """Normalizes text like {@link _normalize_text _normalize_text}, ignoring
+    case."""
+    return _normalize_text(text).lower()
+
+def _normalize_pairs(text):
+    """Normalizes a {@link MatchingQuestion MatchingQuestion} answer into an
+    unordered set of pairs."""
+    pairs = set()
+    for item in unicode(text).split(u','):
+        if not item.strip():
+            continue
+        key, sep, value = item.partition(u':')
+        pairs.add((key.strip(), value.strip()))
+    return frozenset(pairs)
+
+def _parse_number(text):
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+    # Reject nan and infinities
+    if number - number != 0:
+        return None
+    return number
+
+class AnswerKey(object):
+    """
+    A machine gradeable answer key, prepared for fast grading.
+    
+    <p>Accepted answers are normalized once, when the key is built, and kept
+    in hash tables, so checking a student answer takes one normalization and
+    one lookup.  How answers are normalized depends on the type of question
+    (see {@link normalizers normalizers}); questions the key's test doesn't
+    have only get their whitespace and Unicode composition normalized.  A
+    question may have several accepted answers.</p>
+    
+    <p>If an accepted answer is a number, answers within
+    {@link tolerance tolerance} of it (relative to its size, or absolute for
+    numbers smaller than 1) are also accepted.  This does not apply to
+    {@link MatchingQuestion matching questions}.</p>
+    
+    @cvar normalizers The normalization function for each type of question
+    @type normalizers dict
+    @ivar test_id The ID of the test the key is for
+    @type test_id str
+    @ivar tolerance The numeric tolerance
+    @type tolerance float
+    """
+    normalizers = {TrueFalseQuestion: _normalize_folded,
+                   MultipleChoiceQuestion: _normalize_folded,
+                   ShortAnswerQuestion: _normalize_folded,
+                   MatchingQuestion: _normalize_pairs,}
+    
+    def __init__(self, answers=(), test=None, tolerance=1e-6):
+        """
+        Builds an answer key.
+        
+        @keyword answers The accepted answers
+        @type answers dict/list of {@link Answer Answers}
+        @keyword test The test the key is for
+        @type test {@link Test Test}
+        @keyword tolerance The numeric tolerance
+        @type tolerance float
+        """
+        self.test_id = test.id if test is not None else None
+        self.tolerance = tolerance
+        self._normalizers = {}
+        self._accepted = {}
+        self._numbers = {}
+        if test is not None:
+            for question in test.questions:
+                normalizer = self.normalizers.get(type(question))
+                if normalizer is not None:
+                    self._normalizers[question.id] = normalizer
+        if isinstance(answers, dict):
+            answers = answers.itervalues()
+        for answer in answers:
+            self.add(answer.id, answer.answer)
+    
+    def __len__(self):
+        return len(self._accepted)
+    
+    def __iter__(self):
+        return iter(self._accepted)
+    
+    def __contains__(self, qid):
+        return qid in self._accepted
+    
+    # PUBLIC METHODS #
+    
+    def add(self, qid, answer):
+        """
+        Accepts an answer for a question.
+        
+        @param qid The question's ID
+        @type qid str
+        @param answer The answer to accept
+        @type answer unicode
+        """
+        accepted = self._accepted.setdefault(qid, set())
+        if answer is None:
+            return
+        normalizer = self._normalizers.get(qid, _normalize_text)
+        accepted.add(normalizer(answer))
+        if normalizer is not _normalize_pairs:
+            number = _parse_number(answer)
+            if number is not None:
+                self._numbers.setdefault(qid, []).append(number)
+    
+    def normalize(self, qid, answer):
+        """
+        Normalizes an answer to a question the way the key compares it.
+        
+        @param qid The question's ID
+        @type qid str
+        @param answer The answer to normalize
+        @type answer unicode
+        @return The normalized answer
+        """
+        return self._normalizers.get(qid, _normalize_text)(answer)
+    
+    def check(self, answer):
+        """
+        Checks a student answer against the key.
+        
+        @param answer The answer to check
+        @type answer {@link Answer Answer}
+        @return Whether the answer is correct, or <code>None</code> if the key
+                has no answer for the question
+        @returntype bool
+        """
+        try:
+            accepted = self._accepted[answer.id]
+        except KeyError:
+            return None
+        if answer.answer is None:
+            return False
+        normalizer = self._normalizers.get(answer.id, _normalize_text)
+        if normalizer(answer.answer) in accepted:
+            return True
+        numbers = self._numbers.get(answer.id)
+        if numbers:
+            number = _parse_number(answer.answer)
+            if number is not None:
+                for expected in numbers:
+                    if abs(number - expected) <= \
+                       self.tolerance * max(1.0, abs(expected)):
+                        return True
+        return False
+    
+    def grade(self, answers, results_class=None):
+        """
+        Grades a set of answers.
+        
+        @param answers The student answers
+        @type answers list of {@link Answer Answers}
+        @keyword results_class The type of results to create (defaults to
+                               {@link Results Results})
+        @type results_class type
+        @return A set of results from the grading
+        @returntype {@link Results Results}
+        """
+        if results_class is None:
+            results_class = Results
+        correct = []
+        incorrect = []
+        pending = []
+        for answer in answers:
+            result = self.check(answer)
+            if result is None:
+                # Not found in answer key, mark for teacher grading
+                pending.append(answer.id)
+            elif result:
+                correct.append(answer.id)
+            else:
+                incorrect.append(answer.id)
+        return results_class(correct, incorrect, pending)
 
 class Results(object):
     """
@@ -462,12 +1113,15 @@ class Results(object):
         Collect the results from an answer set.
         
         @param key The machine gradeable answer key
-        @type key dict/list of {@link Answer Answers}
+        @type key {@link AnswerKey AnswerKey} or dict/list of
+                  {@link Answer Answers}
         @param answers The student answers
         @type answers list of {@link Answer Answers}
         @return A set of results from the grading
         @returntype {@link Results Results}
         """
+        if isinstance(key, AnswerKey):
+            return key.grade(answers, cls)
         # Make the key usable
         if not isinstance(key, dict):
             new_key = {}
@@ -521,3 +1175,268 @@ class Results(object):
             self.correct = list(self.correct) + [answer_id]
         else:
             self.incorrect = list(self.incorrect) + [answer_id]
+
+class QuestionIndex(object):
+    """
+    Numbers question IDs, so that sets of questions can be kept as bitsets.
+    
+    IDs are only ever added, so a position, once given, never changes and
+    an index can be shared by all the results for a test.
+    
+    @ivar ids The question IDs, in order of position
+    @type ids list of str
+    """
+    def __init__(self, ids=()):
+        self.ids = []
+        self._positions = {}
+        for qid in ids:
+            self.add(qid)
+    
+    @classmethod
+    def from_test(cls, test):
+        """
+        Creates an index of the questions in a test, in test order.
+        
+        @param test The test to index
+        @type test {@link Test Test}
+        @returntype {@link QuestionIndex QuestionIndex}
+        """
+        return cls(question.id for question in test.questions)
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __contains__(self, qid):
+        return qid in self._positions
+    
+    def add(self, qid):
+        """
+        Adds a question ID to the index, if it isn't there already.
+        
+        @param qid The question ID
+        @type qid str
+        @return The ID's position
+        @returntype int
+        """
+        try:
+            return self._positions[qid]
+        except KeyError:
+            position = self._positions[qid] = len(self.ids)
+            self.ids.append(qid)
+            return position
+    
+    def get_bit(self, qid):
+        """
+        Finds the bit for a question ID.
+        
+        @param qid The question ID
+        @type qid str
+        @return The bit, or <code>0</code> if the ID is not in the index
+        @returntype long
+        """
+        position = self._positions.get(qid)
+        if position is None:
+            return 0
+        return 1 << position
+    
+    def to_mask(self, ids):
+        """
+        Converts question IDs to a bitset, adding any new IDs to the index.
+        
+        @param ids The question IDs
+        @type ids iterable of str
+        @returntype long
+        """
+        mask = 0
+        for qid in ids:
+            mask |= 1 << self.add(qid)
+        return mask
+    
+    def to_ids(self, mask):
+        """
+        Converts a bitset to question IDs.
+        
+        @param mask The bitset
+        @type mask long
+        @return The question IDs, in order of position
+        @returntype list of str
+        """
+        ids = []
+        while mask:
+            low_bit = mask & -mask
+            ids.append(self.ids[low_bit.bit_length() - 1])
+            mask ^= low_bit
+        return ids
+    
+    @staticmethod
+    def encode_mask(mask):
+        """
+        Encodes a bitset as a string, for storage.
+        
+        @param mask The bitset
+        @type mask long
+        @returntype str
+        """
+        return '%x' % mask
+    
+    @staticmethod
+    def decode_mask(data):
+        """
+        Decodes a bitset encoded by {@link encode_mask encode_mask}.
+        
+        @param data The encoded bitset
+        @type data str
+        @returntype long
+        """
+        return int(data, 16) if data else 0
+
+class BitsetResults(Results):
+    """
+    Results kept as bitsets over a {@link QuestionIndex QuestionIndex}.
+    
+    <p>Grading, membership tests and counts take constant time, and the
+    results of a whole class can be combined with bitwise operations on
+    the <code>*_mask</code> attributes.  The <code>correct</code>,
+    <code>incorrect</code> and <code>pending</code> lists are produced on
+    demand, in index order.  A question can only be in each list once.</p>
+    
+    @ivar index The question index the bitsets are over
+    @type index {@link QuestionIndex QuestionIndex}
+    @ivar correct_mask The correct questions
+    @type correct_mask long
+    @ivar incorrect_mask The incorrect questions
+    @type incorrect_mask long
+    @ivar pending_mask The questions needing human grading
+    @type pending_mask long
+    @ivar correct_count The number of correct questions
+    @type correct_count int
+    @ivar incorrect_count The number of incorrect questions
+    @type incorrect_count int
+    @ivar pending_count The number of questions needing human grading
+    @type pending_count int
+    """
+    def __init__(self, correct, incorrect, pending=None, index=None):
+        if index is None:
+            index = QuestionIndex()
+        self.index = index
+        self.correct = correct
+        self.incorrect = incorrect
+        self.pending = pending
+    
+    @classmethod
+    def from_results(cls, results, index=None):
+        """
+        Converts results to bitset form.
+        
+        @param results The results to convert
+        @type results {@link Results Results}
+        @keyword index The question index to use
+        @type index {@link QuestionIndex QuestionIndex}
+        @returntype {@link BitsetResults BitsetResults}
+        """
+        return cls(results.correct, results.incorrect, results.pending,
+                   index)
+    
+    @classmethod
+    def from_masks(cls, index, correct_mask, incorrect_mask, pending_mask=0):
+        """
+        Creates results from bitsets.
+        
+        @param index The question index the bitsets are over
+        @type index {@link QuestionIndex QuestionIndex}
+        @returntype {@link BitsetResults BitsetResults}
+        """
+        results = cls((), (), (), index)
+        results._set_masks(correct_mask, incorrect_mask, pending_mask)
+        return results
+    
+    @classmethod
+    def decode(cls, index, data):
+        """
+        Creates results from the string made by {@link encode encode}.
+        
+        @param index The question index the results were encoded with
+        @type index {@link QuestionIndex QuestionIndex}
+        @param data The encoded results
+        @type data str
+        @raises ValueError if the data is malformed
+        @returntype {@link BitsetResults BitsetResults}
+        """
+        parts = data.split(':')
+        if len(parts) != 3:
+            raise ValueError("Malformed results: %r" % data)
+        return cls.from_masks(index, *[QuestionIndex.decode_mask(part)
+                                       for part in parts])
+    
+    def encode(self):
+        """
+        Encodes the results compactly as a string, for storage.
+        
+        @returntype str
+        """
+        return ':'.join(QuestionIndex.encode_mask(mask)
+                        for mask in (self.correct_mask, self.incorrect_mask,
+                                     self.pending_mask))
+    
+    def _set_masks(self, correct_mask, incorrect_mask, pending_mask):
+        self.correct_mask = correct_mask
+        self.incorrect_mask = incorrect_mask
+        self.pending_mask = pending_mask
+        self.correct_count = bin(correct_mask).count('1')
+        self.incorrect_count = bin(incorrect_mask).count('1')
+        self.pending_count = bin(pending_mask).count('1')
+    
+    def _get_correct(self):
+        return self.index.to_ids(self.correct_mask)
+    def _set_correct(self, value):
+        self.correct_mask = self.index.to_mask(value or ())
+        self.correct_count = bin(self.correct_mask).count('1')
+    correct = property(_get_correct, _set_correct)
+    
+    def _get_incorrect(self):
+        return self.index.to_ids(self.incorrect_mask)
+    def _set_incorrect(self, value):
+        self.incorrect_mask = self.index.to_mask(value or ())
+        self.incorrect_count = bin(self.incorrect_mask).count('1')
+    incorrect = property(_get_incorrect, _set_incorrect)
+    
+    def _get_pending(self):
+        return self.index.to_ids(self.pending_mask)
+    def _set_pending(self, value):
+        self.pending_mask = self.index.to_mask(value or ())
+        self.pending_count = bin(self.pending_mask).count('1')
+    pending = property(_get_pending, _set_pending)
+    
+    def is_correct(self, qid):
+        """Checks whether a question was answered correctly."""
+        return bool(self.correct_mask & self.index.get_bit(qid))
+    
+    def is_incorrect(self, qid):
+        """Checks whether a question was answered incorrectly."""
+        return bool(self.incorrect_mask & self.index.get_bit(qid))
+    
+    def is_pending(self, qid):
+        """Checks whether a question needs human grading."""
+        return bool(self.pending_mask & self.index.get_bit(qid))
+    
+    def grade(self, qid, correct):
+        """
+        Grade a pending answer.
+        
+        @param qid The question ID of the answer
+        @type qid str
+        @param correct Whether the answer was correct
+        @type correct bool
+        @raises ValueError if the answer is not pending
+        """
+        bit = self.index.get_bit(qid)
+        if not self.pending_mask & bit:
+            raise ValueError("Question ID not in pending: %r" % qid)
+        self.pending_mask ^= bit
+        self.pending_count -= 1
+        if correct:
+            self.correct_mask |= bit
+            self.correct_count += 1
+        else:
+            self.incorrect_mask |= bit
+            self.incorrect_count += 1
@@ -5,6 +5,7 @@ pygtk.require('2.0')
 import gtk
 from parse import *
 import model
+import testcache
 
 # File informations
 __author__="Deepank Gupta"
@@ -84,7 +85,7 @@ class Testbook:
         
         # Let's append a bunch of pages to the notebook
         
-        test = parse_test("../data/sample.xml")
+        test = testcache.parse_test("../data/sample.xml")
         i = 1
         for question in test.questions:
             bufferf = "%s    %d credits    %s Difficulty" % (question.question_id, question.credits, question.difficulty)
@@ -7,12 +7,15 @@
 """Parser for test files"""
 
 from base64 import b64decode
-from cStringIO import StringIO
-from gzip import GzipFile
+from hashlib import sha1
 import os
+from Queue import Queue
 import sys
 from textwrap import dedent
-from xml.dom import minidom
+import threading
+from xml.dom import minidom, pulldom
+from xml.sax.saxutils import escape, quoteattr
+import zlib
 
 import model
 
@@ -20,16 +23,21 @@ __author__ = "Ross Light"
 __date__ = "March 25, 2008"
 __docformat__ = "JavaDoc"
 __all__ = ['TestParser',
+           'IncrementalTestParser',
            'AnswersParser',
            'parse_test',
+           'iter_questions',
            'parse_answers',
-           'serialize_answers',]
+           'serialize_answers',
+           'iter_serialize_answers',
+           'write_answers',]
 
 _bool2xml = {False: u"false", True: u"true"}
 _xml2bool = {u"false": False,
              u"0": False,
              u"true": True,
              u"1": True,}
+_answer_xml = u'   <answer hint-used=%s id=%s time-taken=%s>%s</answer>\n'
 
 def _get_text(elem, post=True):
     """
@@ -64,40 +72,124 @@ def _get_text(elem, post=True):
                 text = text[:-1]
     return text
 
-def _get_first_child_named(parent, name):
+def _text_field(name, convert=None):
     """
-    Finds the first child element with a given name.
+    Creates a question child handler that stores the text of the element.
     
-    @param parent The element to search in
-    @type parent DOM element
-    @param name The name of the tag to search for
-    @type name unicode
-    @return The first child with the given tag, or <code>None</code> if not
-            found
-    @returntype DOM element
+    Only the first element with a given name is used.
+    
+    @param name The name of the field to store the text in
+    @type name str
+    @param convert A function to apply to the text before it is stored
+    @type convert callable
+    @return The handler
+    @returntype function
     """
-    results = parent.getElementsByTagName(name)
-    if results:
-        return results[0]
-    else:
-        return None
+    def handler(parser, elem, fields):
+        if name not in fields:
+            value = _get_text(elem)
+            if convert is not None:
+                value = convert(value)
+            fields[name] = value
+    return handler
 
-def _get_child_text(parent, name):
+def _decode_image_data(data):
     """
-    Obtain the text of the first child element with a given name.
+    Decodes the contents of an embedded image element.
     
-    This is equivalent to
-    <code>_get_text(_get_first_child_named(parent, name))</code>.
+    @param data The base64-encoded, gzipped image data
+    @type data unicode
+    @return The raw image data
+    @returntype str
+    """
+    # Decompress in one call so that zlib can release the GIL for all of it
+    return zlib.decompress(b64decode(data), 16 + zlib.MAX_WBITS)
+
+class _EmbeddedImageData(object):
+    """
+    Decodes the contents of an embedded image element on demand.
     
-    @param parent The element to search in
-    @type parent DOM element
-    @param name The name of the tag to search for
-    @type name unicode
-    @return The text of the first child with the given tag, or
-            <code>None</code> if not found
-    @returntype unicode
+    This is used as an {@link model.Image.set_data_loader image data loader};
+    unlike a closure, it can be pickled along with the image.
+    
+    @ivar data The base64-encoded, gzipped image data
+    @type data unicode
+    """
+    def __init__(self, data):
+        self.data = data
+    
+    def __call__(self):
+        return _decode_image_data(self.data)
+
+class _PendingImageData(_EmbeddedImageData):
+    """
+    Embedded image data that is being decoded by an
+    {@link _ImageDecoderPool _ImageDecoderPool}.
+    
+    Calling it waits for the decoding to finish.
     """
-    return _get_text(_get_first_child_named(parent, name))
+    def __init__(self, data):
+        super(_PendingImageData, self).__init__(data)
+        self._ready = threading.Event()
+        self._result = None
+        self._error = None
+    
+    def decode(self):
+        try:
+            self._result = _decode_image_data(self.data)
+        except Exception:
+            self._error = sys.exc_info()
+        self._ready.set()
+    
+    def __call__(self):
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
+    
+    def __reduce__(self):
+        # Events can't be pickled; decode lazily after unpickling instead
+        return (_EmbeddedImageData, (self.data,))
+
+class _ImageDecoderPool(object):
+    """
+    Decodes embedded images on worker threads.
+    
+    Workers exit once every image submitted before
+    {@link shutdown shutdown} has been decoded.
+    """
+    def __init__(self, workers):
+        self._queue = Queue()
+        self._workers = []
+        for i in xrange(workers):
+            worker = threading.Thread(target=self._run)
+            worker.start()
+            self._workers.append(worker)
+    
+    def submit(self, data):
+        """
+        Queues embedded image data for decoding.
+        
+        @param data The base64-encoded, gzipped image data
+        @type data unicode
+        @return A loader that returns the decoded data
+        @returntype callable
+        """
+        pending = _PendingImageData(data)
+        self._queue.put(pending)
+        return pending
+    
+    def shutdown(self):
+        """Stops the workers once the queued images have been decoded."""
+        for worker in self._workers:
+            self._queue.put(None)
+    
+    def _run(self):
+        while True:
+            pending = self._queue.get()
+            if pending is None:
+                return
+            pending.decode()
 
 class TestParser(object):
     """
@@ -110,8 +202,16 @@ class TestParser(object):
     @type document DOM document
     @ivar test The test being constructed
     @type test {@link model.Test Test}
+    @ivar image_workers The number of threads that decode embedded images
+                        while the rest of the document is parsed.  If zero,
+                        images are decoded when they are first used.
+    @type image_workers int
     @see parse_test
     """
+    def __init__(self, image_workers=0):
+        self.image_workers = image_workers
+        self._image_pool = None
+    
     @staticmethod
     def _parse_question_text(elem):
         text = model.QuestionText()
@@ -119,7 +219,7 @@ class TestParser(object):
             if node.nodeType == minidom.Node.ELEMENT_NODE:
                 if node.tagName == 'blank':
                     blank_length = node.getAttribute('length')
-                    if blank_length is None:
+                    if not blank_length:
                         blank_length = 10
                     else:
                         blank_length = int(blank_length)
@@ -140,17 +240,72 @@ class TestParser(object):
         self.document = doc
         root = doc.documentElement
         test_id = root.getAttribute('id')
-        instructions = _get_child_text(root, 'instructions')
-        self.test = model.Test(test_id, instructions)
-        for node in root.childNodes:
-            if node.nodeType == minidom.Node.ELEMENT_NODE:
+        self.test = model.Test(test_id)
+        self._start_image_pool()
+        try:
+            for node in root.childNodes:
+                if node.nodeType == minidom.Node.ELEMENT_NODE:
+                    name = node.tagName
+                    if name == 'question':
+                        self._handle_question(node)
+                    elif name == 'instructions':
+                        if self.test.instructions is None:
+                            self.test.instructions = _get_text(node)
+                    else:
+                        # TODO: Raise error for undetected element
+                        pass
+        finally:
+            self._stop_image_pool()
+        return self.test
+    
+    def iter_parse(self, events):
+        """
+        Incrementally parses a test file, yielding questions as they are read.
+        
+        <p>Only the subtree of the question currently being built is held in
+        memory; it is discarded once the question has been yielded.  The
+        {@link test test} attribute is created (without any questions) as soon
+        as the root element has been read, so the caller decides whether to
+        keep the questions.</p>
+        
+        @param events The pull parser event stream of the file to parse
+        @type events <code>xml.dom.pulldom.DOMEventStream</code>
+        @return The questions of the test, in order of appearance
+        @returntype iterator of {@link model.Question Question}
+        """
+        self.document = None
+        self.test = None
+        self._start_image_pool()
+        try:
+            for event, node in events:
+                if event != pulldom.START_ELEMENT:
+                    continue
+                if self.test is None:
+                    # Root element
+                    self.test = model.Test(node.getAttribute('id'))
+                    continue
                 name = node.tagName
                 if name == 'question':
-                    self._handle_question(node)
-                else:
-                    # TODO: Raise error for undetected element
-                    pass
-        return self.test
+                    events.expandNode(node)
+                    # The pull parser may split text across several nodes
+                    node.normalize()
+                    yield self._build_question(node)
+                elif name == 'instructions' and \
+                     self.test.instructions is None:
+                    events.expandNode(node)
+                    node.normalize()
+                    self.test.instructions = _get_text(node)
+        finally:
+            self._stop_image_pool()
+    
+    def _start_image_pool(self):
+        if self.image_workers > 0:
+            self._image_pool = _ImageDecoderPool(self.image_workers)
+    
+    def _stop_image_pool(self):
+        if self._image_pool is not None:
+            self._image_pool.shutdown()
+            self._image_pool = None
     
     def _handle_question(self, elem):
         """
@@ -159,77 +314,94 @@ class TestParser(object):
         @param elem The question element to process
         @type elem DOM element
         """
-        qtypes = {'short_answer': model.ShortAnswerQuestion,
-                  'multiple_choice': model.MultipleChoiceQuestion,
-                  'true_false': model.TrueFalseQuestion,
-                  'matching': model.MatchingQuestion,
-                  'flashcard': model.FlashCard,}
-        # Find all common elements
+        question = self._build_question(elem)
+        self.test.add_question(question)
+        return question
+    
+    def _build_question(self, elem):
+        """
+        Constructs the question described by a question element.
+        
+        The element's direct children are visited once, each being passed to
+        its handler in {@link _question_handlers _question_handlers}; the
+        collected fields are then given to the constructor registered for the
+        question's type in {@link question_types question_types}.
+        
+        @param elem The question element to process
+        @type elem DOM element
+        @return The new question
+        @returntype {@link model.Question Question}
+        """
         question_id = elem.getAttribute('id')
-        question_type = elem.getAttribute('type')
-        credits = _get_child_text(elem, 'credits')
-        if credits is not None:
-            credits = int(credits)
-        text = self._parse_question_text(_get_first_child_named(elem, 'text'))
-        difficulty = _get_child_text(elem, 'difficulty')
-        advice = _get_child_text(elem, 'advice')
-        hint = _get_child_text(elem, 'hint')
-        average_time = _get_child_text(elem, 'average-time')
-        if average_time is not None:
-            average_time = float(average_time)
-        stipulated_time = _get_child_text(elem, 'stipulated-time')
-        if stipulated_time is not None:
-            stipulated_time = float(stipulated_time)
-        # Determine question type and get additional data
-        question_type = qtypes[question_type]
-        if issubclass(question_type, model.MultipleChoiceQuestion):
-            choice_elems = elem.getElementsByTagName('choice')
-            choices = []
-            for child_elem in choice_elems:
-                choice_name = child_elem.getAttribute('name')
-                choice_text = _get_text(child_elem)
-                choices.append((choice_name, choice_text))
-        elif issubclass(question_type, model.ShortAnswerQuestion):
-            expected_length = int(_get_child_text(elem, 'expected-length'))
-        elif issubclass(question_type, model.MatchingQuestion):
-            keys = [_get_text(e) for e in elem.getElementsByTagName('key')]
-            answers = [_get_text(e) for e in
-                       elem.getElementsByTagName('answer')]
-        elif issubclass(question_type, model.FlashCard):
-            back_text = _get_child_text(elem, 'back-text')
-        # Create question
-        if issubclass(question_type, model.MultipleChoiceQuestion):
-            newQuestion = question_type(question_id, text, choices,
-                                        credits, difficulty)
-        elif issubclass(question_type, model.ShortAnswerQuestion):
-            newQuestion = question_type(question_id, text, expected_length,
-                                        credits, difficulty)
-        elif issubclass(question_type, model.MatchingQuestion):
-            newQuestion = question_type(question_id, text, keys, answers,
-                                        credits, difficulty)
-        elif issubclass(question_type, model.FlashCard):
-            newQuestion = question_type(question_id, text, back_text,
-                                        credits, difficulty)
-        else:
-            newQuestion = question_type(question_id, text, credits, difficulty)
-        newQuestion.advice = advice
-        newQuestion.hint = hint
-        newQuestion.average_time = average_time
-        newQuestion.stipulated_time = stipulated_time
-        # Get images
+        question_class, extra_fields = self.question_types[
+            elem.getAttribute('type')]
+        fields = {'choices': [], 'keys': [], 'answers': [], 'images': []}
+        handlers = self._question_handlers
         for child in elem.childNodes:
             if child.nodeType == minidom.Node.ELEMENT_NODE:
-                new_image = None
-                if child.tagName == 'img':
-                    new_image = self._handle_image(child)
-                elif child.tagName == 'image-page':
-                    new_image = self._handle_image_page(child)
-                if new_image is not None:
-                    newQuestion.images.append(new_image)
-        # Add question to test
-        self.test.add_question(newQuestion)
+                handler = handlers.get(child.tagName)
+                if handler is not None:
+                    handler(self, child, fields)
+        # Create question
+        args = [fields.get(name) for name in extra_fields]
+        args.append(fields.get('credits'))
+        args.append(fields.get('difficulty'))
+        newQuestion = question_class(question_id, fields.get('text'), *args)
+        newQuestion.advice = fields.get('advice')
+        newQuestion.hint = fields.get('hint')
+        newQuestion.average_time = fields.get('average_time')
+        newQuestion.stipulated_time = fields.get('stipulated_time')
+        newQuestion.images.extend(fields['images'])
         return newQuestion
     
+    # QUESTION CHILD HANDLERS #
+    
+    def _handle_text(self, elem, fields):
+        if 'text' not in fields:
+            fields['text'] = self._parse_question_text(elem)
+    
+    def _handle_choice(self, elem, fields):
+        fields['choices'].append((elem.getAttribute('name'), _get_text(elem)))
+    
+    def _handle_key(self, elem, fields):
+        fields['keys'].append(_get_text(elem))
+    
+    def _handle_answer(self, elem, fields):
+        fields['answers'].append(_get_text(elem))
+    
+    def _handle_question_image(self, elem, fields):
+        fields['images'].append(self._handle_image(elem))
+    
+    def _handle_question_image_page(self, elem, fields):
+        fields['images'].append(self._handle_image_page(elem))
+    
+    _question_handlers = {
+        'credits': _text_field('credits', int),
+        'text': _handle_text,
+        'difficulty': _text_field('difficulty'),
+        'advice': _text_field('advice'),
+        'hint': _text_field('hint'),
+        'average-time': _text_field('average_time', float),
+        'stipulated-time': _text_field('stipulated_time', float),
+        'expected-length': _text_field('expected_length', int),
+        'back-text': _text_field('back_text'),
+        'choice': _handle_choice,
+        'key': _handle_key,
+        'answer': _handle_answer,
+        'img': _handle_question_image,
+        'image-page': _handle_question_image_page,
+    }
+    
+    # Question type name -> (class, fields passed to the constructor after
+    # the ID and text)
+    question_types = {
+        'short_answer': (model.ShortAnswerQuestion, ('expected_length',)),
+        'multiple_choice': (model.MultipleChoiceQuestion, ('choices',)),
+        'true_false': (model.TrueFalseQuestion, ()),
+        'matching': (model.MatchingQuestion, ('keys', 'answers')),
+        'flashcard': (model.FlashCard, ('back_text',)),
+    }
+    
     def _handle_image_page(self, elem):
         page = model.ImagePage(title=elem.getAttribute('title'))
         for child in elem.childNodes:
@@ -253,23 +425,141 @@ class TestParser(object):
         height = elem.getAttribute('height')
         if height:
             height = int(height)
-        if not width or not height:
-            # TODO: Do a proportional scaling trick
+        if not width and not height:
             size = None
         else:
-            size = (width, height)
+            # A missing dimension is scaled proportionally when rendering
+            size = (width or None, height or None)
         # Get data
         data = _get_text(elem, post=False)
-        if data:
-            data = b64decode(data)
-            data = GzipFile(fileobj=StringIO(data))
         # Construct image
         image = model.Image(mime_type, title, size, position)
-        image.set_link(link)
-        if data is not None:
-            image.set_data(data)
+        if link:
+            image.set_link(link)
+        if data:
+            if self._image_pool is not None:
+                image.set_data_loader(self._image_pool.submit(data))
+            else:
+                image.set_data_loader(_EmbeddedImageData(data))
         return image
 
+def _get_fingerprint(elem):
+    """
+    Fingerprints an element by the SHA-1 of a canonical form of its XML.
+    
+    <p>Comments, processing instructions and whitespace-only text are left
+    out, and adjacent text is joined, so an element gets the same
+    fingerprint whether it was parsed with <code>minidom</code> or
+    <code>pulldom</code>.</p>
+    
+    @param elem The element to fingerprint
+    @type elem DOM element
+    @returntype str
+    """
+    digest = sha1()
+    def add_text(chunks):
+        text = u''.join(chunks)
+        del chunks[:]
+        if text.strip():
+            digest.update(escape(text).encode('utf-8'))
+    def add(elem):
+        digest.update(('<' + elem.tagName).encode('utf-8'))
+        for name, value in sorted(elem.attributes.items()):
+            digest.update((u' %s=%s' % (name, quoteattr(value)))
+                          .encode('utf-8'))
+        digest.update('>')
+        chunks = []
+        for child in elem.childNodes:
+            if child.nodeType in (minidom.Node.TEXT_NODE,
+                                  minidom.Node.CDATA_SECTION_NODE):
+                chunks.append(child.data)
+            elif child.nodeType == minidom.Node.ELEMENT_NODE:
+                add_text(chunks)
+                add(child)
+        add_text(chunks)
+        digest.update(('</%s>' % elem.tagName).encode('utf-8'))
+    add(elem)
+    return digest.hexdigest()
+
+class IncrementalTestParser(TestParser):
+    """
+    Parses successive versions of a test file, reusing unchanged questions.
+    
+    <p>Each question element is fingerprinted by the SHA-1 of its XML
+    (ignoring comments and whitespace-only text).  When the same parser is
+    used on an edited version of a file, the {@link model.Question Question}
+    objects built for elements that have not changed (including their
+    decoded images) are reused, and only the other elements are decoded
+    again.</p>
+    
+    @ivar changed_ids The IDs of the questions that are new or were changed
+                      in the last parse, in order of appearance.  On the first
+                      parse, this is every question.
+    @type changed_ids list of str
+    @ivar removed_ids The IDs of the questions from the previous parse that
+                      are no longer present
+    @type removed_ids list of str
+    @see parse_test
+    """
+    def __init__(self, image_workers=0):
+        super(IncrementalTestParser, self).__init__(image_workers)
+        self.changed_ids = []
+        self.removed_ids = []
+        self._previous = {}
+        self._current = {}
+        self._used = {}
+    
+    def parse(self, doc):
+        self._begin()
+        test = super(IncrementalTestParser, self).parse(doc)
+        self._finish()
+        return test
+    
+    def iter_parse(self, events):
+        self._begin()
+        for question in super(IncrementalTestParser, self).iter_parse(events):
+            yield question
+        self._finish()
+    
+    def _begin(self):
+        self.changed_ids = []
+        self.removed_ids = []
+        self._current = {}
+        # How many of the previous questions with each fingerprint have been
+        # reused.  The previous parse is left alone until this one finishes,
+        # so a failed parse can't lose any of it.
+        self._used = {}
+    
+    def _finish(self):
+        current_ids = set(question.id for questions in
+                          self._current.itervalues()
+                          for question in questions)
+        self.removed_ids = [question.id
+                            for fingerprint, questions
+                            in self._previous.iteritems()
+                            for question
+                            in questions[self._used.get(fingerprint, 0):]
+                            if question.id not in current_ids]
+        self._previous = self._current
+        self._current = {}
+        self._used = {}
+    
+    def _build_question(self, elem):
+        fingerprint = _get_fingerprint(elem)
+        # Identical elements share a fingerprint, so each one takes the next
+        # question from the list
+        previous = self._previous.get(fingerprint, ())
+        used = self._used.get(fingerprint, 0)
+        if used < len(previous):
+            question = previous[used]
+            self._used[fingerprint] = used + 1
+        else:
+            question = super(IncrementalTestParser,
+                             self)._build_question(elem)
+            self.changed_ids.append(question.id)
+        self._current.setdefault(fingerprint, []).append(question)
+        return question
+
 class AnswersParser(object):
     """
     Parses answer XML files.
@@ -326,7 +616,7 @@ class AnswersParser(object):
         # Create answer
         newAnswer = model.Answer(question_id, answer, time_taken, hint_used)
         # Add answer to list
-        self.answer_list.answers.append(newAnswer)
+        self.answer_list.append(newAnswer)
         return newAnswer
 
 def _parse(parser, document, *args, **kw):
@@ -354,7 +644,7 @@ def _parse(parser, document, *args, **kw):
     # Run parser and return result
     return parser.parse(document)
 
-def parse_test(document):
+def parse_test(document, streaming=False, parser=None):
     """
     Parses a test file.
     
@@ -363,10 +653,43 @@ def parse_test(document):
                     parsed.  Otherwise, it is interpreted as a file-like object
                     attempts to parse it.
     @type document str, DOM document, or file-like object
+    @keyword streaming Whether to read the file incrementally instead of
+                       building a DOM of the whole document first.  A DOM
+                       document cannot be streamed.
+    @type streaming bool
+    @keyword parser The parser to use.  Pass the same
+                    {@link IncrementalTestParser IncrementalTestParser} each
+                    time a file is re-opened to reuse its unchanged
+                    questions.
+    @type parser {@link TestParser TestParser}
     @return The archived test
     @returntype {@link model.Test Test}
+    @see iter_questions
+    """
+    if parser is None:
+        parser = TestParser()
+    if not streaming:
+        return _parse(parser, document)
+    for question in parser.iter_parse(pulldom.parse(document)):
+        parser.test.add_question(question)
+    return parser.test
+
+def iter_questions(document):
+    """
+    Incrementally parses the questions of a test file.
+    
+    Each question is yielded as soon as its element has been read and its
+    subtree is discarded afterward, so memory use is bounded by the largest
+    question rather than by the whole file.
+    
+    @param document Document to parse.  If given a string, it is interpreted as
+                    a path.  Otherwise, it is interpreted as a file-like
+                    object.
+    @type document str or file-like object
+    @return The test's questions, in order of appearance
+    @returntype iterator of {@link model.Question Question}
     """
-    return _parse(TestParser(), document)
+    return TestParser().iter_parse(pulldom.parse(document))
 
 def parse_answers(document):
     """
@@ -409,6 +732,63 @@ def serialize_answers(answers):
         root.appendChild(elem)
     return doc
 
+def iter_serialize_answers(answers, student_name=None, encoding='utf-8'):
+    """
+    Generate an XML document for a list of answers, piece by piece.
+    
+    <p>Unlike {@link serialize_answers serialize_answers}, no document tree is
+    built: each answer is formatted as it is taken from
+    <code>answers</code>, so the answers can come from a generator and never
+    be held in memory all at once.  The output can be read back with
+    {@link parse_answers parse_answers}.</p>
+    
+    @param answers The answers to serialize
+    @type answers iterable of {@link model.Answer Answer objects}
+    @keyword student_name The name of the student answering.  Defaults to the
+                          <code>student_name</code> attribute of
+                          <code>answers</code>, if present.
+    @type student_name unicode
+    @keyword encoding The character encoding of the document
+    @type encoding str
+    @return The chunks of the document, in order
+    @returntype iterator of str
+    """
+    if student_name is None:
+        student_name = getattr(answers, 'student_name', None)
+    yield '<?xml version="1.0" encoding=%s?>\n' % quoteattr(encoding)
+    yield '<answer-list>\n'
+    # Add student name
+    if student_name is not None:
+        yield (u'   <student-name>%s</student-name>\n'
+               % escape(student_name)).encode(encoding)
+    # Add answers
+    for answer in answers:
+        chunk = _answer_xml % (quoteattr(_bool2xml[bool(answer.hint_used)]),
+                               quoteattr(answer.id),
+                               quoteattr(unicode(answer.time_taken)),
+                               escape(answer.answer or u''))
+        yield chunk.encode(encoding)
+    yield '</answer-list>\n'
+
+def write_answers(answers, out, student_name=None, encoding='utf-8'):
+    """
+    Write an XML document for a list of answers to a file.
+    
+    @param answers The answers to serialize
+    @type answers iterable of {@link model.Answer Answer objects}
+    @param out The file to write to
+    @type out file-like object
+    @keyword student_name The name of the student answering.  Defaults to the
+                          <code>student_name</code> attribute of
+                          <code>answers</code>, if present.
+    @type student_name unicode
+    @keyword encoding The character encoding of the document
+    @type encoding str
+    @see iter_serialize_answers
+    """
+    for chunk in iter_serialize_answers(answers, student_name, encoding):
+        out.write(chunk)
+
 # Test: Parse data/sample.xml
 
 def main(args=None):
@@ -460,7 +840,7 @@ def main(args=None):
     answers = [q.answer("Hello, World!", 42.0) for q in test.questions
                if not isinstance(q, (model.FlashCard, model.MatchingQuestion))]
     answer_list = model.AnswerList(answers, "Ross Light")
-    print serialize_answers(answer_list).toprettyxml(indent='   ')
+    write_answers(answer_list, sys.stdout)
     return 0
 
 if __name__ == '__main__':
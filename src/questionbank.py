@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+#
+#   questionbank.py
+#   Educational toolkit
+#
+
+"""Indexed question banks for assembling randomized tests"""
+
+from bisect import bisect_left, bisect_right
+import random
+
+import model
+
+__docformat__ = "JavaDoc"
+__all__ = ['QuestionBank',]
+
+def _get_time(question):
+    if question.stipulated_time is None:
+        return 0.0
+    return question.stipulated_time
+
+def _get_credits(question):
+    if question.credits is None:
+        return 0
+    return question.credits
+
+class _Bucket(object):
+    """The questions in a bank with the same type, difficulty and credits."""
+    __slots__ = ('questions', 'times', 'sorted')
+    def __init__(self):
+        self.questions = []
+        self.times = []
+        self.sorted = True
+    
+    def add(self, question):
+        self.questions.append(question)
+        self.sorted = False
+    
+    def count_within(self, max_time):
+        """Counts the questions that take at most <code>max_time</code>."""
+        if max_time is None:
+            return len(self.questions)
+        if not self.sorted:
+            self.questions.sort(key=_get_time)
+            self.times = [_get_time(question) for question in self.questions]
+            self.sorted = True
+        return bisect_right(self.times, max_time)
+
+class QuestionBank(object):
+    """
+    A pool of questions from many tests, indexed for sampling.
+    
+    <p>Questions are grouped into buckets by type, difficulty and credits,
+    and each bucket is kept sorted by stipulated time.  Selecting questions
+    only looks at the buckets (never at every question), and questions are
+    drawn by index, so sampling takes time in proportion to the number of
+    buckets and questions drawn rather than the size of the bank.</p>
+    
+    <p>Questions with no stipulated time are treated as taking no time.
+    Question IDs are only unique within a test, so a sample never includes
+    two questions with the same ID.</p>
+    """
+    def __init__(self, tests=()):
+        self._buckets = {}
+        self._size = 0
+        for test in tests:
+            self.add_test(test)
+    
+    def __len__(self):
+        return self._size
+    
+    # PUBLIC METHODS #
+    
+    def add_test(self, test):
+        """
+        Adds every question of a test to the bank.
+        
+        @param test The test to add
+        @type test {@link model.Test Test}
+        """
+        for question in test.questions:
+            self.add_question(question)
+    
+    def add_question(self, question):
+        """
+        Adds a question to the bank.
+        
+        @param question The question to add
+        @type question {@link model.Question Question}
+        """
+        key = (type(question), question.difficulty, question.credits)
+        try:
+            bucket = self._buckets[key]
+        except KeyError:
+            bucket = self._buckets[key] = _Bucket()
+        bucket.add(question)
+        self._size += 1
+    
+    def count(self, types=None, difficulties=None, credits=None,
+              max_time=None):
+        """
+        Counts the questions that meet a set of constraints.
+        
+        @keyword types The allowed question types (subclasses are allowed,
+                       too)
+        @type types tuple of type
+        @keyword difficulties The allowed difficulties
+        @type difficulties iterable of unicode
+        @keyword credits The lowest and highest number of credits allowed
+        @type credits tuple of int
+        @keyword max_time The longest stipulated time allowed
+        @type max_time float
+        @returntype int
+        """
+        selection = self._select(types, difficulties, credits, max_time)
+        return sum(count for key, bucket, count in selection)
+    
+    def sample(self, count, types=None, difficulties=None, credits=None,
+               max_time=None, difficulty_mix=None, total_credits=None,
+               rng=None):
+        """
+        Picks questions at random that meet a set of constraints.
+        
+        @param count The number of questions to pick
+        @type count int
+        @keyword types The allowed question types (subclasses are allowed,
+                       too)
+        @type types tuple of type
+        @keyword difficulties The allowed difficulties
+        @type difficulties iterable of unicode
+        @keyword credits The lowest and highest number of credits allowed
+        @type credits tuple of int
+        @keyword max_time The longest stipulated time allowed
+        @type max_time float
+        @keyword difficulty_mix The number of questions to pick of each
+                                difficulty.  The counts must add up to
+                                <code>count</code>.
+        @type difficulty_mix dict
+        @keyword total_credits The number of credits the questions must be
+                               worth in all
+        @type total_credits int
+        @keyword rng The random number generator to use
+        @type rng <code>random.Random</code>
+        @raises ValueError if the constraints can't be met
+        @return The questions, in random order
+        @returntype list of {@link model.Question Question}
+        """
+        if rng is None:
+            rng = random
+        chosen_ids = set()
+        picks = []
+        if difficulty_mix is None:
+            selection = self._select(types, difficulties, credits, max_time)
+            picks.extend(self._draw(selection, count, rng, chosen_ids))
+        else:
+            if sum(difficulty_mix.itervalues()) != count:
+                raise ValueError("Difficulty mix does not add up to %d"
+                                 % count)
+            for difficulty, difficulty_count in sorted(
+                    difficulty_mix.iteritems()):
+                selection = self._select(types, [difficulty], credits,
+                                         max_time)
+                picks.extend(self._draw(selection, difficulty_count, rng,
+                                        chosen_ids))
+        if total_credits is not None:
+            self._adjust_credits(picks, total_credits, types, credits,
+                                 max_time, rng, chosen_ids)
+        rng.shuffle(picks)
+        return picks
+    
+    def make_test(self, test_id, count, instructions=None, **kw):
+        """
+        Assembles a randomized test from the bank.
+        
+        The keyword arguments are the constraints taken by
+        {@link sample sample}.
+        
+        @param test_id The ID of the new test
+        @type test_id str
+        @param count The number of questions on the test
+        @type count int
+        @keyword instructions The test's instructions
+        @type instructions unicode
+        @raises ValueError if the constraints can't be met
+        @returntype {@link model.Test Test}
+        """
+        test = model.Test(test_id, instructions)
+        for question in self.sample(count, **kw):
+            test.add_question(question)
+        return test
+    
+    def make_variants(self, test_id, variant_count, count, seed=None, **kw):
+        """
+        Assembles a randomized variant of a test for each student.
+        
+        The variants are named <code><var>test_id</var>-<var>n</var></code>.
+        The keyword arguments are those taken by {@link make_test make_test}.
+        
+        @param test_id The base ID of the tests
+        @type test_id str
+        @param variant_count The number of variants to make
+        @type variant_count int
+        @param count The number of questions on each test
+        @type count int
+        @keyword seed The seed for the random number generator
+        @raises ValueError if the constraints can't be met
+        @returntype list of {@link model.Test Test}
+        """
+        rng = random.Random(seed)
+        return [self.make_test('%s-%d' % (test_id, i + 1), count, rng=rng,
+                               **kw)
+                for i in xrange(variant_count)]
+    
+    # SAMPLING #
+    
+    def _select(self, types, difficulties, credits, max_time):
+        """
+        Finds the buckets that meet a set of constraints.
+        
+        @return (key, bucket, number of questions allowed) triples
+        @returntype list of tuple
+        """
+        if types is not None:
+            types = tuple(types)
+        if difficulties is not None:
+            difficulties = frozenset(difficulties)
+        selection = []
+        for key, bucket in self._buckets.iteritems():
+            question_type, difficulty, question_credits = key
+            if types is not None and not issubclass(question_type, types):
+                continue
+            if difficulties is not None and difficulty not in difficulties:
+                continue
+            if credits is not None and \
+               not credits[0] <= question_credits <= credits[1]:
+                continue
+            count = bucket.count_within(max_time)
+            if count:
+                selection.append((key, bucket, count))
+        # Keep draws repeatable for a given seed
+        selection.sort(key=lambda item: (item[0][0].__name__,) + item[0][1:])
+        return selection
+    
+    def _draw(self, selection, count, rng, chosen_ids):
+        """
+        Picks questions from a selection of buckets.
+        
+        Each allowed question is equally likely to be picked.  Questions
+        whose ID is in <code>chosen_ids</code> are skipped, and the IDs of
+        the picked questions are added to it.
+        """
+        starts = []
+        total = 0
+        for key, bucket, bucket_count in selection:
+            starts.append(total)
+            total += bucket_count
+        picks = []
+        tried = set()
+        while len(picks) < count:
+            if len(tried) >= total:
+                raise ValueError("Only %d of %d questions can be picked"
+                                 % (len(picks), count))
+            index = rng.randrange(total)
+            if index in tried:
+                continue
+            tried.add(index)
+            i = bisect_right(starts, index) - 1
+            question = selection[i][1].questions[index - starts[i]]
+            if question.id in chosen_ids:
+                continue
+            chosen_ids.add(question.id)
+            picks.append(question)
+        return picks
+    
+    def _adjust_credits(self, picks, total_credits, types, credits, max_time,
+                        rng, chosen_ids, max_swaps=1000):
+        """
+        Swaps picked questions until they are worth the requested number of
+        credits.
+        
+        A question is only swapped for one of the same difficulty, so a
+        difficulty mix is kept.  Questions with no credits count as being
+        worth none, and are never swapped in.
+        """
+        if not picks:
+            if total_credits != 0:
+                raise ValueError("Can't make %d credits from no questions"
+                                 % total_credits)
+            return
+        current = sum(_get_credits(question) for question in picks)
+        for swap in xrange(max_swaps):
+            if current == total_credits:
+                return
+            i = rng.randrange(len(picks))
+            old = picks[i]
+            wanted = _get_credits(old) + total_credits - current
+            selection = self._select(types, [old.difficulty], credits,
+                                     max_time)
+            levels = sorted(set(key[2] for key, bucket, count in selection
+                                if key[2] is not None))
+            if not levels:
+                continue
+            # Move as close to the total as this question allows
+            j = bisect_left(levels, wanted)
+            if j == len(levels) or \
+               (j > 0 and wanted - levels[j - 1] < levels[j] - wanted):
+                j -= 1
+            if levels[j] == _get_credits(old):
+                continue
+            selection = [item for item in selection
+                         if item[0][2] == levels[j]]
+            try:
+                new = self._draw(selection, 1, rng, chosen_ids)[0]
+            except ValueError:
+                continue
+            chosen_ids.discard(old.id)
+            picks[i] = new
+            current += new.credits - _get_credits(old)
+        if current != total_credits:
+            raise ValueError("Can't make %d credits from %d questions"
+                             % (total_credits, len(picks)))
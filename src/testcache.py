@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+#
+#   testcache.py
+#   Educational toolkit
+#
+
+"""On-disk cache of parsed test files"""
+
+import cPickle as pickle
+from hashlib import sha1
+import os
+from tempfile import mkstemp
+
+import parse
+
+__docformat__ = "JavaDoc"
+__all__ = ['DEFAULT_CACHE_DIR',
+           'TestCache',
+           'parse_test',]
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'),
+                                 '.educationaltoolkit', 'test-cache')
+_CACHE_VERSION = 4
+_CACHE_SUFFIX = '.test'
+
+class TestCache(object):
+    """
+    A directory of compiled tests, keyed by the SHA-1 of the test file.
+    
+    <p>A test is stored in pickled form after it has been parsed once, and
+    later loads of a file with the same content are served from the cache.
+    Since entries are keyed by content, editing a test file automatically
+    invalidates its old entry; stale entries are removed by evicting the
+    least recently used entries whenever the cache grows past
+    {@link max_size max_size}.</p>
+    
+    <p>The (path, mtime, size) of each file seen is remembered, so a file that
+    has not been touched is not even re-hashed within one process.</p>
+    
+    @ivar directory The directory the cache is stored in
+    @type directory str
+    @ivar max_size The maximum total size of the cache (in bytes)
+    @type max_size int
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR,
+                 max_size=16 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self._digests = {}
+    
+    def parse_test(self, path):
+        """
+        Loads a test file, using the cache if possible.
+        
+        @param path The path of the test file
+        @type path str
+        @return The test the file represents
+        @returntype {@link model.Test Test}
+        """
+        entry_path = self._get_entry_path(path)
+        test = self._load_entry(entry_path)
+        if test is None:
+            test = parse.parse_test(path)
+            self._store_entry(entry_path, test)
+        return test
+    
+    def clear(self):
+        """Removes every entry from the cache."""
+        for entry_path, size, mtime in self._list_entries():
+            self._remove(entry_path)
+    
+    def _get_digest(self, path):
+        stat = os.stat(path)
+        stamp = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+        try:
+            return self._digests[stamp]
+        except KeyError:
+            pass
+        checksum = sha1()
+        f = open(path, 'rb')
+        try:
+            while True:
+                data = f.read(64 * 1024)
+                if not data:
+                    break
+                checksum.update(data)
+        finally:
+            f.close()
+        digest = self._digests[stamp] = checksum.hexdigest()
+        return digest
+    
+    def _get_entry_path(self, path):
+        name = '%s-%d%s' % (self._get_digest(path), _CACHE_VERSION,
+                            _CACHE_SUFFIX)
+        return os.path.join(self.directory, name)
+    
+    def _load_entry(self, entry_path):
+        try:
+            f = open(entry_path, 'rb')
+        except EnvironmentError:
+            return None
+        try:
+            try:
+                test = pickle.load(f)
+            except Exception:
+                # Unreadable or corrupt entry; it will be overwritten
+                return None
+        finally:
+            f.close()
+        # Mark as recently used
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+        return test
+    
+    def _store_entry(self, entry_path, test):
+        """
+        Stores a test in the cache.
+        
+        The cache is only an optimization, so failing to write it (for
+        example, because the directory is read-only) is silently ignored.
+        """
+        temp_path = None
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Write to a temporary file first so that readers never see a
+            # partial entry
+            fd, temp_path = mkstemp(suffix='.tmp', dir=self.directory)
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump(test, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(temp_path, entry_path)
+            temp_path = None
+            self._evict()
+        except (EnvironmentError, pickle.PicklingError):
+            if temp_path is not None:
+                self._remove(temp_path)
+    
+    def _list_entries(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            if name.endswith(_CACHE_SUFFIX):
+                entry_path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((entry_path, stat.st_size, stat.st_mtime))
+        return entries
+    
+    def _evict(self):
+        entries = self._list_entries()
+        total_size = sum(size for entry_path, size, mtime in entries)
+        # Least recently used first
+        entries.sort(key=lambda entry: entry[2])
+        for entry_path, size, mtime in entries:
+            if total_size <= self.max_size:
+                break
+            self._remove(entry_path)
+            total_size -= size
+    
+    @staticmethod
+    def _remove(entry_path):
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+
+_default_cache = None
+
+def parse_test(path):
+    """
+    Loads a test file through the default {@link TestCache cache}.
+    
+    @param path The path of the test file
+    @type path str
+    @return The test the file represents
+    @returntype {@link model.Test Test}
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = TestCache()
+    return _default_cache.parse_test(path)